@@ -1,7 +1,5 @@
 # controller/edit_tree_model.py
 
-import copy
-
 from PyQt5.QtCore import (QAbstractItemModel, QModelIndex, Qt, QMimeData, QByteArray,
                           QDataStream, QIODevice, QPersistentModelIndex)
 from PyQt5.QtWidgets import QApplication
@@ -9,12 +7,14 @@ from PyQt5.QtGui import QFont
 from model.helper import (real_folder, virtual_folder,
                           MimeTypes, DropCopyFolder, DropMoveFolder,
                           DropCopyFile, DropMoveFile, Shared)
+from controller.tree_model import build_tree
 from collections import namedtuple, defaultdict
 
 DirData = namedtuple('DirData', 'dir_id parent_id is_virtual path')
 ALL_ITEMS = defaultdict(list)
 
 class EditTreeItem(object):
+    __slots__ = ('parent_', 'userData', 'itemData', 'children', '_row', 'has_more')
 
     def __init__(self, data_, user_data=None, parent=None):
         self.parent_ = parent
@@ -24,24 +24,53 @@ class EditTreeItem(object):
             self.userData = None
         self.itemData = data_
         self.children = []
+        self._row = 0                   # position in children of parent
+        self.has_more = False           # children are not loaded yet
 
     def childNumber(self):
-        if self.parent_ != None:
-            return self.parent_.children.index(self)
-        return 0
+        return self._row
 
     def removeChildren(self, position, count):
         print('--> removeChildren from', len(self.children), self.userData)
         if position < 0 or position + count > len(self.children):
             return False
 
-        for row in range(count):
-            print('  ', self.children[position].userData)
-            self.children.pop(position)
+        for item in self.children[position:position + count]:
+            item.forget()
+        del self.children[position:position + count]
+        self._renumber(position)
         print('  childCount', self.childCount(), len(self.children))
 
         return True
 
+    def _renumber(self, position):
+        for row in range(position, len(self.children)):
+            self.children[row]._row = row
+
+    def forget(self):
+        """
+        Remove item and its subtree from ALL_ITEMS
+        :return: None
+        """
+        copies = ALL_ITEMS.get(self.userData.dir_id)
+        if copies and self in copies:
+            copies.remove(self)
+        for child in self.children:
+            child.forget()
+
+    def clone(self):
+        """
+        Copy of item with copies of its subtree, data are shared:
+        they are immutable tuples
+        :return: EditTreeItem without parent
+        """
+        item = EditTreeItem(self.itemData)
+        item.userData = self.userData
+        item.has_more = self.has_more
+        for child in self.children:
+            item.appendChild(child.clone())
+        return item
+
     def is_virtual(self):
         return self.userData.is_virtual > 0
 
@@ -76,20 +105,51 @@ class EditTreeItem(object):
 
     def appendChild(self, item):
         item.parent_ = self
-        print('--> appendChild to:', self.userData)
         item.userData = item.userData._replace(parent_id=self.userData.dir_id)
-        print('             Child:', item.userData)
         ALL_ITEMS[item.userData.dir_id].append(item)
+        item._row = len(self.children)
         self.children.append(item)
 
+    def insertChild(self, position, item):
+        """
+        :param position: row of item in children
+        :param item: EditTreeItem with its subtree registered in ALL_ITEMS
+        :return: None
+        """
+        ALL_ITEMS[item.userData.dir_id].append(item)
+        self.place_child(position, item)
+
+    def place_child(self, position, item):
+        item.parent_ = self
+        item.userData = item.userData._replace(parent_id=self.userData.dir_id)
+        self.children.insert(position, item)
+        self._renumber(position)
+
+    def take_child(self, position):
+        """
+        Remove child, it stays in ALL_ITEMS - to be placed in other parent
+        :param position:
+        :return: EditTreeItem
+        """
+        item = self.children.pop(position)
+        self._renumber(position)
+        return item
+
+    def child_position(self, path):
+        """
+        :param path: of new child
+        :return: row of new child to keep children ordered by path
+        """
+        for row, child in enumerate(self.children):
+            if child.userData.path > path:
+                return row
+        return len(self.children)
+
     def parent(self):
         return self.parent_
 
     def row(self):
-        if self.parent_:
-            return self.parent_.children.index(self)
-
-        return 0
+        return self._row
 
     def set_data(self, data_):
         self.itemData = data_
@@ -108,6 +168,7 @@ class EditTreeModel(QAbstractItemModel):
         super(EditTreeModel, self).__init__(parent)
 
         self.rootItem = EditTreeItem(data_=('',), user_data=(0, 0, 0, "Root"))
+        self._load_children = None
         ALL_ITEMS.clear()
 
     @staticmethod
@@ -200,7 +261,7 @@ class EditTreeModel(QAbstractItemModel):
                                         *new_parent_data[2:4],
                                         new_parent_data[1]))
         for idx in idx_list:
-            item = copy.deepcopy(QModelIndex(idx).internalPointer())
+            item = QModelIndex(idx).internalPointer().clone()
             item.userData = item.userData._replace(parent_id=new_parent_data[2])
             Shared['DB utility'].update_other('DIR_PARENT', (new_parent_data[0], 
                                               item.userData.dir_id))
@@ -260,13 +321,109 @@ class EditTreeModel(QAbstractItemModel):
 
         return parentItem.childCount()
 
+    def hasChildren(self, parent=QModelIndex()):
+        item = self.getItem(parent)
+        return item.has_more or item.childCount() > 0
+
+    def set_loader(self, load_children):
+        """
+        Lazy mode: top level items are loaded now, children of item -
+        when view needs them (canFetchMore / fetchMore)
+        :param load_children: function: dir_id -> rows as in set_model_data
+                with flag "has children" as the last element
+        :return: None
+        """
+        self._load_children = load_children
+        self.rootItem.has_more = True
+        self.fetchMore(QModelIndex())
+
+    def canFetchMore(self, parent):
+        return self.getItem(parent).has_more
+
+    def fetchMore(self, parent):
+        item = self.getItem(parent)
+        if not item.has_more:
+            return
+        item.has_more = False
+        rows = self._load_children(item.userData.dir_id)
+        if rows:
+            position = item.childCount()
+            self.beginInsertRows(parent, position, position + len(rows) - 1)
+            for row in rows:
+                child = EditTreeItem(data_=(row[0],), user_data=row[1:-1])
+                child.has_more = bool(row[-1])
+                item.appendChild(child)
+            self.endInsertRows()
+
     def setHeaderData(self, p_int, orientation, value, role=None):
         if isinstance(value, str):
             value = value.split(';')
         self.rootItem.set_data(value)
 
+    def apply_dir_changes(self, new_rows, moved):
+        """
+        Show new and moved directories in loaded part of tree, not loaded
+        branches get them from data base when fetched
+        :param new_rows: rows as for set_loader, parents before children,
+               the last element - dir has children other than new and moved
+        :param moved: list of (dir_id, old parent_id, new parent_id),
+               new dirs are in new_rows with their last parent
+        :return: None
+        """
+        for row in new_rows:
+            for parent_item in self._fetched_items(row[2]):
+                item = EditTreeItem(data_=(row[0],), user_data=row[1:-1])
+                item.has_more = bool(row[-1])
+                position = parent_item.child_position(item.userData.path)
+                self.beginInsertRows(self._item_index(parent_item), position, position)
+                parent_item.insertChild(position, item)
+                self.endInsertRows()
+
+        for dir_id, old_parent_id, parent_id in moved:
+            targets = self._fetched_items(parent_id)
+            for item in [it for it in ALL_ITEMS.get(dir_id, ())
+                         if it.parent_ and it.parent_.userData.dir_id == old_parent_id]:
+                if targets:
+                    self._move_item(item, targets[0])
+                    for target in targets[1:]:
+                        self.append_child(item.clone(), self._item_index(target))
+                else:
+                    self.remove_row(self._item_index(item))
+
+    def _fetched_items(self, dir_id):
+        """
+        Items of dir_id with loaded children, there are several if dir
+        has virtual copies
+        """
+        if dir_id == 0:
+            return [self.rootItem]
+        return [item for item in ALL_ITEMS.get(dir_id, ()) if not item.has_more]
+
+    def _item_index(self, item):
+        if item is self.rootItem:
+            return QModelIndex()
+        return self.createIndex(item.row(), 0, item)
+
+    def _move_item(self, item, target):
+        source = item.parent_
+        row = item.row()
+        position = target.child_position(item.userData.path)
+        if not self.beginMoveRows(self._item_index(source), row, row,
+                                  self._item_index(target), position):
+            self.append_child(item.clone(), self._item_index(target))
+            self.remove_row(self._item_index(item))
+            return
+        source.take_child(row)
+        target.place_child(position, item)
+        self.endMoveRows()
+
     def append_child(self, item: EditTreeItem, parent):
         parentItem: EditTreeItem = self.getItem(parent)
+        if self.canFetchMore(parent):
+            self.fetchMore(parent)      # item may be already in data base
+            if any(child.userData.dir_id == item.userData.dir_id
+                   for child in parentItem.children):
+                return True
         item.userData = item.userData._replace(parent_id=parentItem.userData.dir_id)
         position = parentItem.childCount()
 
@@ -290,20 +447,11 @@ class EditTreeModel(QAbstractItemModel):
                   item[1]  - Id of item, unique,
                   item[2]  - Id of parent item, 0 for root,
                         ...
-             and sorted by item(2) - parent ID - in descendant order
+             children of item are in order of rows
         :return: None
         """
-        id_list = []
-        items_dict = {0: self.rootItem}
-        for row in rows:
-            if not isinstance(row[0], tuple):
-                row = ((row[0],),) + tuple(row[1:])
-            items_dict[row[1]] = EditTreeItem(data_=row[0], user_data=(row[1:]))
-            id_list.append((row[1:]))
-
-        for id_ in id_list:
-            if id_[1] in items_dict:
-                items_dict[id_[1]].appendChild(copy.deepcopy(items_dict[id_[0]]))
+        build_tree(self.rootItem, rows,
+                   lambda data_, user_data: EditTreeItem(data_=data_, user_data=user_data))
 
     def supportedDropActions(self):
         return Qt.CopyAction | Qt.MoveAction
@@ -403,7 +551,7 @@ class EditTreeModel(QAbstractItemModel):
 
     def _move_folder(self, index, parent):
         item = index.internalPointer()
-        self.append_child(copy.deepcopy(item), parent)
+        self.append_child(item.clone(), parent)
 
         parent_id = self.data(parent, role=Qt.UserRole).dir_id
         item_id = self.data(index, role=Qt.UserRole).dir_id
@@ -413,7 +561,7 @@ class EditTreeModel(QAbstractItemModel):
 
     def _copy_folder(self, index, parent):
         item: EditTreeItem = index.internalPointer()
-        new_item: EditTreeItem = copy.deepcopy(item)
+        new_item: EditTreeItem = item.clone()
         if item.is_favorites():
             new_item.userData = item.userData._replace(is_virtual=2)
         self.append_child(new_item, parent)
@@ -441,3 +589,82 @@ class EditTreeModel(QAbstractItemModel):
             idx = idx.parent()
         path.reverse()
         return path
+
+
+if __name__ == "__main__":
+    # build time of directory tree versus number of folders:
+    # python -m controller.edit_tree_model
+    import random
+    import time
+
+    def _folders(count, fanout=8):
+        """
+        rows for set_model_data: deeper levels first, as in TREE select
+        """
+        level = {0: -1}
+        rows = []
+        for dir_id in range(1, count + 1):
+            parent_id = random.randint(dir_id // fanout, dir_id - 1) if dir_id > 1 else 0
+            level[dir_id] = level[parent_id] + 1
+            rows.append(('d{}'.format(dir_id), dir_id, parent_id, 0, '/d{}'.format(dir_id)))
+        for dir_id in random.sample(range(2, count + 1), count // 100):   # virtual copies
+            rows.append(('d{}'.format(dir_id), dir_id, random.randint(1, count), 2,
+                         '/d{}'.format(dir_id)))
+        rows.sort(key=lambda row: -level[row[2]])
+        return rows
+
+    random.seed(1)
+    print('folders   build, s   parent() of all, s')
+    for n in (1000, 10000, 50000, 100000):
+        dirs = _folders(n)
+        model = EditTreeModel()
+        start = time.perf_counter()
+        model.set_model_data(dirs)
+        built = time.perf_counter() - start
+
+        start = time.perf_counter()
+        stack = [QModelIndex()]
+        while stack:
+            parent = stack.pop()
+            for row in range(model.rowCount(parent)):
+                idx = model.index(row, 0, parent)
+                model.parent(idx)
+                stack.append(idx)
+        print('{:>7}   {:8.3f}   {:8.3f}'.format(n, built, time.perf_counter() - start))
+
+    def _splice(real, virt):
+        """
+        former MyController._insert_virt_dirs: each virtual folder is put
+        before its parent by list.index + list.insert, O(n) per folder
+        """
+        dir_tree = list(real)
+        id_list = [x[1] for x in dir_tree]
+        for vd in virt:
+            try:
+                idx = id_list.index(vd[2])
+                dir_tree.insert(idx, vd)
+                id_list.insert(idx, vd[1])
+            except ValueError:
+                pass
+        return dir_tree
+
+    print()
+    print('  real  virtual   splice, s   assemble, s   build, s')
+    for n, v in ((100000, 1000), (100000, 5000)):
+        dirs = _folders(n)
+        real = [row for row in dirs if row[3] != 2]
+        virt = [(name, id_, random.randint(1, n), 2, path)
+                for name, id_, _, _, path in random.sample(real[1:], v)]
+
+        start = time.perf_counter()
+        _splice(real, virt)
+        spliced = time.perf_counter() - start
+
+        # build_tree groups rows by parent in one pass, any order of rows
+        start = time.perf_counter()
+        rows = real + virt
+        assembled = time.perf_counter() - start
+        start = time.perf_counter()
+        EditTreeModel().set_model_data(rows)
+        print('{:>6} {:>6}   {:9.3f}   {:11.3f}   {:8.3f}'.format(
+            n, v, spliced, assembled, time.perf_counter() - start))
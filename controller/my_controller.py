@@ -1,37 +1,37 @@
 # controller/my_controller.py
 
 import os
-import re
 import sqlite3
 import webbrowser
 from collections import namedtuple
 
 from PyQt5.QtCore import (Qt, QModelIndex, QItemSelectionModel, QSettings, QDate,
                           QDateTime, QVariant, QItemSelection, QThread,
-                          QPersistentModelIndex)
+                          QPersistentModelIndex, QPoint)
 from PyQt5.QtWidgets import (QInputDialog, QLineEdit, QFileDialog, QLabel,
                              QFontDialog, QApplication, QMessageBox)
 
 from controller.places import Places
-from controller.table_model import TableModel, ProxyModel2
+from controller.table_model import TableModel, FileTableModel, ProxyModel2
 from controller.tree_model import TreeModel
 from controller.edit_tree_model import EditTreeModel, EditTreeItem
+from model.file_hash import FileHash
 from model.file_info import FileInfo, LoadFiles
-from model.helper import (EXT_ID_INCREMENT, Fields, Shared, show_message)
-from model.utilities import DBUtils
+from model.helper import (EXT_ID_INCREMENT, Fields, FileData, Shared, show_message)
+from model.utilities import (DBUtils, CountedConnection, DETECT_TYPES, BUSY_TIMEOUT,
+                             STATEMENT_CACHE)
 from model import create_db
 from model.load_db_data import LoadDBData
+from model.tag_scanner import TagScanner
 from view.input_date import DateInputDialog
 from view.item_edit import ItemEdit
 from view.sel_opt import SelOpt
 from view.set_fields import SetFields
 
-DETECT_TYPES = sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES
-FileData = namedtuple('FileData', 'file_id dir_id comment_id ext_id place_id source')
-
 
 class MyController():
     FOLDER, VIRTUAL, ADVANCE = (1, 2, 4)
+    DETAIL_PAGE = 40        # rows prefetched above and below current file if view is not shown
 
     def __init__(self):
         view = Shared['AppWindow']
@@ -60,10 +60,14 @@ class MyController():
                 'Dirs Create virtual folder': self._create_virtual,
                 'Dirs Delete folder': self._delete_virtual,
                 'Dirs Remove empty folders': self._del_empty_dirs,
+                'Dirs Rebuild tree': self._rebuild_dir_tree,
                 'Dirs Group': self._add_group_folder,
                 'Dirs Rename folder': self._rename_folder,
                 'Dirs Rescan dir': self._rescan_dir,
+                'Dirs Full rescan dir': self._full_rescan_dir,
+                'Dirs Refresh file info': self._refresh_file_info,
                 'dirTree': self._populate_directory_tree,  # emit from Places
+                'Duplicates': self._show_duplicates,
                 'Edit authors': self._edit_authors,
                 'Edit comment': self._edit_comment,
                 'Edit key words': self._edit_key_words,
@@ -82,6 +86,8 @@ class MyController():
                 'File Open folder': self._open_folder,
                 'File Open': self._open_file,
                 'File Rename file': self._rename_file,
+                'Hash after scan': self._set_hash_after_scan,
+                'Hash files': self._hash_files,
                 'File_doubleClicked': self._double_click_file,
                 'Resize columns': self._resize_columns,
                 'Select files': self._list_of_selected_files,
@@ -202,15 +208,16 @@ class MyController():
         indexes = self._persistent_row_indexes(self.ui.filesList)
         model = self.ui.filesList.model().sourceModel()
         disk_letter = self._cb_places.get_mount_point()
-        for idx in indexes:
-            if idx.column() == 0:
-                file_name = model.data(idx)
-                u_dat = model.data(idx, Qt.UserRole)
-                file_path, _ = self._dbu.select_other('PATH', (u_dat.dir_id,)).fetchone()
-                if disk_letter:
-                    file_path = os.altsep.join((disk_letter, file_path))
-                file_data = file_._make((idx, os.path.join(file_path, file_name), u_dat, file_name))
-                files.append(file_data)
+        indexes = [idx for idx in indexes if idx.column() == 0]
+        user_data = [model.data(idx, Qt.UserRole) for idx in indexes]
+        paths = self._dbu.get_lookup('path').get_many(u_dat.dir_id for u_dat in user_data)
+        for idx, u_dat in zip(indexes, user_data):
+            file_name = model.data(idx)
+            file_path, _ = paths[u_dat.dir_id]
+            if disk_letter:
+                file_path = os.altsep.join((disk_letter, file_path))
+            file_data = file_._make((idx, os.path.join(file_path, file_name), u_dat, file_name))
+            files.append(file_data)
         return files
 
     def _move_file_to(self, dir_id, place_id, to_path, file):
@@ -228,16 +235,16 @@ class MyController():
         import shutil
         try:
             shutil.copy2(file_.name_with_path, to_path)
-            file_id = self._dbu.select_other2('FILE_IN_DIR', (dir_id, file_.name)).fetchone()
+            file_id = self._dbu.select_other('FILE_IN_DIR', (dir_id, file_.name)).fetchone()
             if file_id:
                 new_file_id = file_id[0]
             else:
-                new_file_id = self._dbu.insert_other2('COPY_FILE',
-                                                      (dir_id, place_id,
-                                                       file_.user_data[0]))
+                new_file_id = self._dbu.insert_other('COPY_FILE',
+                                                     (dir_id, place_id,
+                                                      file_.user_data[0]))
 
-            self._dbu.insert_other2('COPY_TAGS', (new_file_id, file_.user_data[0]))
-            self._dbu.insert_other2('COPY_AUTHORS', (new_file_id, file_.user_data[0]))
+            self._dbu.insert_other('COPY_TAGS', (new_file_id, file_.user_data[0]))
+            self._dbu.insert_other('COPY_AUTHORS', (new_file_id, file_.user_data[0]))
         except IOError:
             show_message("Can't copy file \"{}\" into folder \"{}\"".
                          format(file_[3], to_path), 5000)
@@ -252,27 +259,30 @@ class MyController():
 
         tmp_place = Places.CurrPlace._make(0, state, *registered_place)
 
-        return MyController._find_or_create_dir_id(tmp_place, to_path), tmp_place.id_
+        dir_id, tree_changes = MyController._find_or_create_dir_id(tmp_place, to_path)
+        if tmp_place.id_ == self._cb_places.get_curr_place().id_:
+            self._update_dir_tree(tree_changes)
+        return dir_id, tmp_place.id_
 
     @staticmethod
     def _find_or_create_dir_id(tmp_place, to_path):
+        """
+        :return: (DirID, TreeChanges)
+        """
         trantab = str.maketrans(os.sep, os.altsep)
         path = to_path.translate(trantab)
         if tmp_place.disk_state == Places.MOUNTED:
             path = path.partition(os.altsep)[2]
 
         ld = LoadDBData(tmp_place)
-        return ld.insert_dir(path)
+        return ld.insert_dir(path), ld.get_tree_changes()
 
     def _copy_files(self):
         if self._cb_places.get_disk_state() & (Places.MOUNTED | Places.NOT_REMOVAL):
             to_path = QFileDialog().getExistingDirectory(self.ui.filesList,
                                                          'Select the folder to copy')
             if to_path:
-                place_id = self.copy_files_to(to_path)
-
-                if place_id == self._cb_places.get_curr_place().id_:
-                    self._populate_directory_tree()
+                self.copy_files_to(to_path)     # dirTree is updated by _get_dir_id
         else:
             param = self._cb_places.get_curr_place().title
             show_message('File(s) inaccessible on "{}"'.format(param))
@@ -307,10 +317,7 @@ class MyController():
             to_path = QFileDialog().getExistingDirectory(self.ui.filesList,
                                                          'Select the folder to move')
             if to_path:
-                place_id = self.move_files_to(to_path)
-
-                if place_id == self._cb_places.get_curr_place().id_:
-                    self._populate_directory_tree()
+                self.move_files_to(to_path)     # dirTree is updated by _get_dir_id
         else:
             param = self._cb_places.get_curr_place().title
             show_message('File(s) inaccessible on "{}"'.format(param))
@@ -365,6 +372,7 @@ class MyController():
                                            '', QLineEdit.Normal, tag)
             if ok:
                 self._dbu.update_other('UPDATE_TAG', (tag, id_))
+                self._dbu.get_lookup('details').invalidate()
                 self.ui.tagsList.model().update(idx, tag, Qt.DisplayRole)
 
     def _copy_file_name(self):
@@ -397,12 +405,18 @@ class MyController():
         self.same_db = the_same
         if create:
             _connection = sqlite3.connect(file_name, check_same_thread=False,
-                                          detect_types=DETECT_TYPES)
+                                          detect_types=DETECT_TYPES, timeout=BUSY_TIMEOUT,
+                                          cached_statements=STATEMENT_CACHE,
+                                          factory=CountedConnection)
             create_db.create_all_objects(_connection)
         else:
             if os.path.isfile(file_name):
                 _connection = sqlite3.connect(file_name, check_same_thread=False,
-                                              detect_types=DETECT_TYPES)
+                                              detect_types=DETECT_TYPES,
+                                              timeout=BUSY_TIMEOUT,
+                                              cached_statements=STATEMENT_CACHE,
+                                              factory=CountedConnection)
+                create_db.update_db(_connection)
             else:
                 show_message("Data base does not exist")
                 return
@@ -431,36 +445,39 @@ class MyController():
 
     def _scan_for_tags(self):
         """
-        Tags are searched if files with selected EXTENSIONS
+        Selected tags are searched in names, book titles and comments
+        of files with selected EXTENSIONS, in one pass over files
         :return:
         """
-        show_message('Scan in files with selected extensions')
         ext_idx = MyController._selected_db_indexes(self.ui.extList)
         all_id = self._collect_all_ext(ext_idx)
-
         sel_tag = self.get_selected_tags()
-        for tag in sel_tag:
-            files = self._dbu.select_other2(
-                'FILE_INFO', (','.join([str(i) for i in all_id]),
-                              tag[1])).fetchall()
-            for file in files:
-                if re.search(tag[0], file[0], re.IGNORECASE):
-                    try:
-                        self._dbu.insert_other('TAG_FILE', (tag[1], file[1]))
-                    except sqlite3.IntegrityError:
-                        pass
+        if not (all_id and sel_tag):
+            show_message('Select tags and extensions of files to scan', 5000)
+            return
+
+        show_message('Scan in files with selected extensions')
+        self.obj_thread = TagScanner(sel_tag, all_id)
+        self.obj_thread.progress.connect(MyController._show_tag_scan_progress)
+        self._run_in_qthread(self._finish_tag_scan)
+
+    def _finish_tag_scan(self):
+        show_message('Scan for tags is finished: {} tags are added to files'.
+                     format(self.obj_thread.get_added()), 5000)
+
+    @staticmethod
+    def _show_tag_scan_progress(done, total):
+        show_message('Scan for tags: {} of {} files'.format(done, total))
 
     def get_selected_tags(self):
+        """
+        :return: list of (tag, TagID) selected in tagsList
+        """
         idxs = self.ui.tagsList.selectedIndexes()
-        t_ids = []
-        tag_s = []
-        rb = r'\b'
         if idxs:
             model = self.ui.tagsList.model()
-            for i in idxs:
-                t_ids.append(model.data(i, Qt.UserRole))
-                tag_s.append(rb + model.data(i, Qt.DisplayRole) + rb)
-            return list(zip(tag_s, t_ids))
+            return [(model.data(i, Qt.DisplayRole), model.data(i, Qt.UserRole))
+                    for i in idxs]
         return []
 
     def _ask_for_change_font(self):
@@ -546,16 +563,82 @@ class MyController():
 
     def _dir_update(self):
         updated_dirs = self.obj_thread.get_updated_dirs()
-        self._populate_directory_tree()
+        changes = self.obj_thread.get_changes()
+        for path, file_ in changes.removed:
+            print('--> _dir_update, removed:', path, file_)
+        show_message('Scan: {} added, {} removed, {} modified files'.
+                     format(changes.added, len(changes.removed), len(changes.modified)), 5000)
+        self._update_dir_tree(self.obj_thread.get_tree_changes())
+        self._restore_file_list(self.ui.dirTree.currentIndex())   # new files of current dir
         self._populate_ext_list()
 
         self.obj_thread = FileInfo(self._cb_places, updated_dirs)
-        self._run_in_qthread(MyController._finish_thread)
+        self.obj_thread.progress.connect(MyController._show_progress)
+        self._run_in_qthread(self._file_info_finished)
+
+    def _file_info_finished(self):
+        MyController._finish_thread()
+        if QSettings().value('HASH_AFTER_SCAN', False, type=bool):
+            self._hash_files()
+
+    @staticmethod
+    def _set_hash_after_scan(arg):
+        settings = QSettings()
+        settings.setValue('HASH_AFTER_SCAN', arg[0] == '1')
+
+    def _hash_files(self):
+        """
+        Content hashes of files in current place, to find duplicates
+        :return: None
+        """
+        if (self._cb_places.get_disk_state()
+                & (Places.MOUNTED | Places.NOT_REMOVAL | Places.NOT_DEFINED)):
+            self.obj_thread = FileHash(self._cb_places)
+            self.obj_thread.progress.connect(MyController._show_hash_progress)
+            self._run_in_qthread(self._finish_hashing)
+        else:
+            show_message("Can't hash files. Disk is not accessible.")
+
+    def _finish_hashing(self):
+        groups, files = self.obj_thread.get_groups()
+        show_message('Hashing is finished: {} duplicate files in {} groups'.
+                     format(files, groups), 5000)
+
+    @staticmethod
+    def _show_hash_progress(done, total):
+        show_message('Hashing of files: {} of {}'.format(done, total))
+
+    def _show_duplicates(self):
+        """
+        Groups of files with the same content in all places
+        :return: None
+        """
+        model = self._set_file_model()
+        found = self._show_files(*self._dbu.select_lazy('DUPLICATES'), model=model, source=-1)
+        if found:
+            self.status_label.setText('Duplicates ({})'.format(found))
+        else:
+            show_message('No duplicates found. Use "Hash files" first.', 5000)
+
+    def on_search(self, text):
+        """
+        Files found by full text search in all places
+        :param text: from search box
+        :return: None
+        """
+        model = self._set_file_model()
+        self.ui.filesList.header().setSortIndicator(-1, Qt.AscendingOrder)   # keep rank order
+        found = self._show_files(*(self._dbu.search_files(text) or ((),)), model=model, source=-1)
+        if found:
+            self.status_label.setText('Found ({})'.format(found))
+        else:
+            show_message('Nothing found for "{}"'.format(text), 5000)
 
     def _run_in_qthread(self, finish):
         self.in_thread = QThread()
         self.obj_thread.moveToThread(self.in_thread)
         self.obj_thread.finished.connect(self.in_thread.quit)
+        self.in_thread.finished.connect(self._dbu.get_lookup('details').invalidate)
         self.in_thread.finished.connect(finish)
         self.in_thread.started.connect(self.obj_thread.run)
         self.in_thread.start()
@@ -564,6 +647,10 @@ class MyController():
     def _finish_thread():
         show_message('Updating of files is finished', 5000)
 
+    @staticmethod
+    def _show_progress(done, total):
+        show_message('Updating of files: {} of {}'.format(done, total))
+
     def _favorite_file_list(self):
         place_id = self._cb_places.get_curr_place().id_
         fav_id = self._dbu.select_other('FAV_ID', (place_id,)).fetchone()
@@ -588,12 +675,8 @@ class MyController():
 
     def files_virtual_folder(self, dir_id):
         model = self._set_file_model()
-        files = self._dbu.select_other('FILES_VIRT', (dir_id,)).fetchall()
-
-        if files:
-            self._show_files(files, model, dir_id)
-            return True
-        return False
+        files = self._dbu.select_lazy('FILES_VIRT', (dir_id,))
+        return self._show_files(*files, model=model, source=dir_id) > 0
 
     def _selection_options(self):
         """
@@ -612,9 +695,8 @@ class MyController():
         res = self._opt.get_result()
         model = self._set_file_model()
 
-        curs = self._dbu.advanced_selection(res, self._cb_places.get_curr_place().id_)
-        if curs:
-            self._show_files(curs, model, -1)
+        files = self._dbu.advanced_selection(res, self._cb_places.get_curr_place().id_)
+        if files and self._show_files(*files, model=model, source=-1):
             self.file_list_source = MyController.ADVANCE
             settings = QSettings()
             settings.setValue('FILE_LIST_SOURCE', self.file_list_source)
@@ -663,7 +745,7 @@ class MyController():
         self._dbu.delete_other('TAG_FILE_BY_FILE', (file_ids[0],))
         self._dbu.delete_other('FILE', (file_ids[0],))
         # when file for this comment not exist in DB
-        self._dbu.delete_other2('COMMENT', (file_ids[2], file_ids[2]))
+        self._dbu.delete_other('COMMENT', {'comment_id': file_ids[2]})
 
     def _open_folder(self):
         path, _, state, _, _ = self._file_path()
@@ -740,7 +822,7 @@ class MyController():
                 f_idx = model.sourceModel().createIndex(f_idx.row(), 0)
             file_name = model.sourceModel().data(f_idx)
             file_id, dir_id, *_ = model.sourceModel().data(f_idx, role=Qt.UserRole)
-            path, place_id = self._dbu.select_other('PATH', (dir_id,)).fetchone()
+            path, place_id = self._dbu.get_lookup('path').get(dir_id)
             state = self._cb_places.get_state(place_id)
             if state == Places.MOUNTED:
                 root = self._cb_places.get_mount_point()
@@ -795,7 +877,7 @@ class MyController():
                 self._dbu.delete_other(sqls[2], (item,))
 
     def _add_item_links(self, items2add, file_id, sqls):
-        add_ids = self._dbu.select_other2(sqls[0], ('","'.join(items2add),)).fetchall()
+        add_ids = self._dbu.select_other(sqls[0], (DBUtils.id_list(items2add),)).fetchall()
         sel_items = [item[0] for item in add_ids]
         not_in_ids = [item for item in items2add if not item in sel_items]
 
@@ -883,7 +965,10 @@ class MyController():
         else:                       # MyController.ADVANCE
             self._list_of_selected_files()
 
-        if self.ui.filesList.model().rowCount() == 0:
+        model = self.ui.filesList.model()
+        while row >= model.rowCount() and model.canFetchMore(QModelIndex()):
+            model.fetchMore(QModelIndex())
+        if model.rowCount() == 0:
             idx = QModelIndex()
         else:
             idx = self.ui.filesList.model().index(row, 0)
@@ -1026,41 +1111,52 @@ class MyController():
         settings.setValue('FILE_LIST_SOURCE', self.file_list_source)
         model = self._set_file_model()
         if dir_idx:
-            files = self._dbu.select_other('FILES_CURR_DIR', (dir_idx[0], self._cb_places.get_curr_place().id_))
-            self._show_files(files, model, 0)
+            files = self._dbu.select_lazy('FILES_CURR_DIR', (dir_idx[0],
+                                                             self._cb_places.get_curr_place().id_))
+            found = self._show_files(*files, model=model, source=0)
 
-            self.status_label.setText('{} ({})'.format(dir_idx[-1],
-                                                       model.rowCount(QModelIndex())))
+            self.status_label.setText('{} ({})'.format(dir_idx[-1], found))
         else:
             self.status_label.setText('No data')
 
     def _set_file_model(self):
-        model = TableModel(parent=self.ui.filesList)
+        old_model = self.ui.filesList.model()
+        if old_model:
+            old_model.sourceModel().close_source()
+        model = FileTableModel(parent=self.ui.filesList)
         proxy_model = ProxyModel2()
         proxy_model.setSourceModel(model)
         model.setHeaderData(0, Qt.Horizontal, getattr(self.fields, 'headers'))
+        header = self.ui.filesList.header()
+        if self.ui.filesList.isSortingEnabled() and header.sortIndicatorSection() >= 0:
+            # new list in sort order of previous one
+            model.set_sort(header.sortIndicatorSection(), header.sortIndicatorOrder())
         self.ui.filesList.setModel(proxy_model)
         return proxy_model
 
-    def _show_files(self, files, model, source):
+    def _show_files(self, files, count=None, order_by=None, model=None, source=0):
         """
-        populateS file's model
-        :param files
+        populateS file's model, rows are fetched by chunks when view needs them
+        :param files: cursor of its own or list
+        :param count: function returning number of files, see DBUtils.select_lazy
+        :param order_by: function returning files sorted by column of select
         :param model
         :param source -  0 - if file from real folder,
                         -1 - if custom list of files
                         >0 - it is dir_id of virtual folder
+        :return: number of files
         """
         idx = getattr(self.fields, 'indexes')
         s_model = model.sourceModel()
-        for ff in files:
-            ff1 = [ff[i] for i in idx]
-            s_model.append_row(tuple(ff1), FileData(*ff[-5:], source))
+        s_model.set_source(files, lambda ff: ([ff[i] for i in idx], FileData(*ff[-5:], source)),
+                           count, order_by and (lambda column, order: order_by(
+                               idx[column] + 1, order == Qt.DescendingOrder)))
 
         self.ui.filesList.selectionModel().currentRowChanged.connect(self._cur_file_changed)
         index_ = model.index(0, 0)
         self.ui.filesList.setCurrentIndex(index_)
         self.ui.filesList.setFocus()
+        return s_model.total_count()
 
     def _cur_file_changed(self, curr_idx):
         """
@@ -1076,34 +1172,48 @@ class MyController():
 
     def _populate_comment_field(self, user_data, edit=False):
         file_id = user_data.file_id
-        comment_id = user_data.comment_id
         if file_id:
             assert isinstance(file_id, int), \
                 "the type of file_id is {} instead of int".format(type(file_id))
 
-            tags = self._dbu.select_other("FILE_TAGS", (file_id,)).fetchall()
-            authors = self._dbu.select_other("FILE_AUTHORS", (file_id,)).fetchall()
-
-            if comment_id:
-                comment = self._dbu.select_other("FILE_COMMENT", (comment_id,)).fetchone()
-            else:
-                comment = ('', '')
+            details = self._dbu.get_lookup('details')
+            if edit:
+                details.invalidate(file_id)
+            elif file_id not in details:
+                self._prefetch_details()
+            info = details.get(file_id)
 
             self.ui.commentField.setText(''.join((
                 '<html><body><p><a href="Edit key words">Key words</a>: {}</p>'
-                .format(', '.join([tag[0] for tag in tags])),
+                .format(', '.join(info.tags)),
                 '<p><a href="Edit authors">Authors</a>: {}</p>'
-                .format(', '.join([author[0] for author in authors])),
-                '<p><a href="Edit title"4>Title</a>: {}</p>'.format(comment[1]),
+                .format(', '.join(info.authors)),
+                '<p><a href="Edit title"4>Title</a>: {}</p>'.format(info.title),
                 '<p><a href="Edit comment">Comment</a> {}</p></body></html>'
-                .format(comment[0]))))
+                .format(info.comment))))
 
-            path = self._dbu.select_other('PATH', (user_data.dir_id,)).fetchone()
+            path = self._dbu.get_lookup('path').get(user_data.dir_id)
             self.status_label.setText(path[0])
 
             if edit:
                 self._update_comment_date(file_id)
 
+    def _prefetch_details(self):
+        """
+        Read details of files around current row of filesList: visible
+        rows and a page of rows above and below, see DetailCache
+        :return: None
+        """
+        view = self.ui.filesList
+        model = view.model()
+        top = view.indexAt(QPoint(0, 0))
+        bottom = view.indexAt(QPoint(0, view.viewport().height() - 1))
+        page = bottom.row() - top.row() + 1 if top.isValid() and bottom.isValid() else MyController.DETAIL_PAGE
+        row = view.currentIndex().row()
+        rows = range(max(row - page, 0), min(row + page + 1, model.rowCount()))
+        self._dbu.get_lookup('details').prefetch(
+            model.data(model.index(i, 0), Qt.UserRole).file_id for i in rows)
+
     def _update_comment_date(self, file_id):
         self._dbu.update_other('COMMENT_DATE', (file_id,))
         model = self.ui.filesList.model()
@@ -1143,16 +1253,11 @@ class MyController():
     def _populate_directory_tree(self):
         # todo - do not correctly restore when reopen from toolbar button
         print('====> _populate_directory_tree')
-        dirs = self._get_dirs(self._cb_places.get_curr_place().id_)
-        self._insert_virt_dirs(dirs)
-
-        for dir_ in dirs:
-            print(dir_)
-
+        self._dbu.get_lookup('path').set_place(self._cb_places.get_curr_place().id_)
         model = EditTreeModel()
         model.set_alt_font(Shared['AppFont'])
 
-        model.set_model_data(dirs)
+        model.set_loader(self._get_child_dirs)     # top level, subdirs on expand
 
         model.setHeaderData(0, Qt.Horizontal, ("Directories",))
         self.ui.dirTree.setModel(model)
@@ -1162,59 +1267,56 @@ class MyController():
 
         self._restore_file_list(cur_dir_idx)
 
-        if dirs:
+        if model.rowCount():
             if self._cb_places.get_disk_state() & (Places.NOT_DEFINED | Places.NOT_MOUNTED):
                 show_message('Files are in an inaccessible place')
             self._resize_columns()
 
-    def _get_dirs(self, place_id):
+    def _get_child_dirs(self, dir_id):
         """
-        Returns directory tree for current place
-        :param place_id:
-        :return: list of tuples (Dir name, DirID, ParentID, isVirtual, Full path of dir)
+        Subdirectories of directory in current place, for lazy dirTree
+        :param dir_id: 0 - top level directories
+        :return: list of tuples (Dir name, DirID, ParentID, isVirtual,
+                 Full path of dir, has subdirectories)
         """
-        dirs = []
-        dir_tree = self._dbu.dir_tree_select(dir_id=0, level=0, place_id=place_id)
+        params = {'dir_id': dir_id, 'place_id': self._cb_places.get_curr_place().id_}
+        return self._tree_rows(self._dbu.select_other('DIR_CHILDREN', params).fetchall() +
+                               self._dbu.select_other('VIRT_DIR_CHILDREN', params).fetchall())
 
+    def _tree_rows(self, dirs):
+        """
+        :param dirs: rows (Path, DirID, ParentID, isVirtual, flag)
+        :return: list of tuples (Dir name, DirID, ParentID, isVirtual,
+                 Full path of dir, flag)
+        """
         if self._cb_places.get_disk_state() == Places.MOUNTED:
             # bind dirs with mount point
             root = self._cb_places.get_mount_point()
-            for rr in dir_tree:
-                dirs.append((os.path.split(rr[0])[1], *rr[1:len(rr)-1],
-                             os.altsep.join((root, rr[0]))))
+            full_path = lambda x: os.altsep.join((root, x))
         else:
-            for rr in dir_tree:
-                print('** ', rr)
-                dirs.append((os.path.split(rr[0])[1], *rr[1:len(rr)-1], rr[0]))
-        return dirs
-
-    def _insert_virt_dirs(self, dir_tree: list):
-        virt_dirs = self._dbu.select_other('VIRT_DIRS', (self._cb_places.get_curr_place().id_,))
-        id_list = [x[1] for x in dir_tree]
+            full_path = lambda x: x
+        return [(os.path.split(rr[0])[1], *rr[1:4], full_path(rr[0]), rr[4])
+                for rr in dirs]
 
-        if self._cb_places.get_disk_state() == Places.MOUNTED:
-            # bind dirs with mount point
-            root = self._cb_places.get_mount_point()
-            for vd in virt_dirs:
-                if vd[-1] == 1:
-                    vd = (*vd[:-1], 2)
-                try:
-                    idx = id_list.index(vd[2])
-                    dir_tree.insert(idx, (os.path.split(vd[0])[1], *vd[1:], 
-                                          os.altsep.join((root, vd[0]))))
-                    id_list.insert(idx, vd[1])
-                except ValueError:
-                    pass
-        else:
-            for vd in virt_dirs:
-                if vd[-1] == 1:
-                    vd = (*vd[:-1], 2)
-                try:
-                    idx = id_list.index(vd[2])
-                    dir_tree.insert(idx, (os.path.split(vd[0])[1], *vd[1:], vd[0]))
-                    id_list.insert(idx, vd[1])
-                except ValueError:
-                    pass
+    def _update_dir_tree(self, changes):
+        """
+        Show in dirTree dirs inserted and moved by scan or by copy / move
+        of files, the tree is not reloaded, its view state is kept
+        :param changes: TreeChanges
+        :return: None
+        """
+        if not (changes.new or changes.moved):
+            return
+        model = self.ui.dirTree.model()
+        if model is None:
+            self._populate_directory_tree()
+            return
+        new_ids = set(changes.new)
+        rows = self._tree_rows(self._dbu.select_other('DIRS_BY_IDS', {
+            'ids': DBUtils.id_list(new_ids | set(changes.moved))}))
+        model.apply_dir_changes([row for row in rows if row[1] in new_ids],
+                                [(row[1], changes.moved[row[1]], row[2]) for row in rows
+                                 if row[1] not in new_ids])
 
     def _cur_dir_changed(self, curr_idx):
         """
@@ -1263,6 +1365,8 @@ class MyController():
                 if parent.isValid():
                     if not self.ui.dirTree.isExpanded(parent):
                         self.ui.dirTree.setExpanded(parent, True)
+                if model.canFetchMore(parent):      # only branches on the path
+                    model.fetchMore(parent)
                 idx = model.index(int(id_), 0, parent)
                 self.ui.dirTree.setCurrentIndex(idx)
                 parent = idx
@@ -1281,7 +1385,22 @@ class MyController():
         self._dbu.delete_other('EMPTY_DIRS', ())
         self._populate_directory_tree()
 
-    def _rescan_dir(self):
+    def _rebuild_dir_tree(self):
+        """
+        Refill DirTree, the closure table used to select subtrees
+        :return: None
+        """
+        self._dbu.rebuild_dir_tree()
+        self._populate_directory_tree()
+
+    def _rescan_dir(self, incremental=True):
+        """
+        :param incremental: False - compare all files with DB, also in
+               directories with unchanged stamp, e.g. to find files
+               edited in place, which change neither mtime of directory
+               nor number of its entries
+        :return: None
+        """
         idx = self.ui.dirTree.currentIndex()
         dir_ = self.ui.dirTree.model().data(idx, Qt.UserRole)
         ext_ = self._get_selected_ext()
@@ -1289,7 +1408,25 @@ class MyController():
                                                     'Input extensions (* - all)',
                                                     QLineEdit.Normal, ext_)
         if ok_pressed:
-            self._load_files(dir_.path, ext_item.strip())
+            self._load_files(dir_.path, ext_item.strip(), incremental)
+
+    def _full_rescan_dir(self):
+        self._rescan_dir(incremental=False)
+
+    def _refresh_file_info(self):
+        """
+        Reload info of all files in current dir and its subdirs,
+        even if size and modification time of file are not changed
+        :return: None
+        """
+        idx = self.ui.dirTree.currentIndex()
+        dir_ = self.ui.dirTree.model().data(idx, Qt.UserRole)
+        place_id = self._cb_places.get_curr_place().id_
+        dir_ids = {str(row[0]) for row in self._dbu.dir_ids_select(dir_.dir_id, 0, place_id)}
+
+        self.obj_thread = FileInfo(self._cb_places, dir_ids, force=True)
+        self.obj_thread.progress.connect(MyController._show_progress)
+        self._run_in_qthread(MyController._finish_thread)
 
     def on_scan_files(self):
         """
@@ -1304,9 +1441,9 @@ class MyController():
         else:
             show_message("Can't scan disk for files. Disk is not accessible.")
 
-    def _load_files(self, path_, ext_):
+    def _load_files(self, path_, ext_, incremental=True):
         curr_place = self._cb_places.get_curr_place()
-        self.obj_thread = LoadFiles(curr_place, path_, ext_)
+        self.obj_thread = LoadFiles(curr_place, path_, ext_, incremental)
         self._run_in_qthread(self._dir_update)
 
     def _scan_file_system(self):
@@ -1,11 +1,21 @@
 # controller/table_model.py
 
+from array import array
 from collections import Iterable
+from datetime import date, datetime
+from functools import lru_cache
+from itertools import islice
+from operator import itemgetter
+from sys import intern
 
 # from PyQt5.QtCore import QModelIndex, Qt, QAbstractTableModel, QSortFilterProxyModel
 from PyQt5.QtCore import (QAbstractTableModel, QModelIndex, Qt, QMimeData, QByteArray,
                           QDataStream, QIODevice, QSortFilterProxyModel)
-from model.helper import MimeTypes, file_virtual, file_real
+from model.helper import MimeTypes, file_virtual, file_real, FileData
+
+FETCH_CHUNK = 1000      # rows added to lazy TableModel by one fetchMore
+DATE_CACHE = 1 << 14    # dates of file list parsed / formatted once
+
 
 class ProxyModel(QSortFilterProxyModel):
 
@@ -42,16 +52,9 @@ class ProxyModel2(ProxyModel):
     def in_real_folder(self, index):
         return self.sourceModel().in_real_folder(self.mapToSource(index))
 
-    def lessThan(self, left, right):
-        s_model = self.sourceModel()
-        left_data = s_model.data(left)
-        right_data = s_model.data(right)
-
-        if s_model.headerData(left.column(), Qt.Horizontal) in ('Pages', 'Size'):
-            left_data = int(left_data) or 0
-            right_data = int(right_data) or 0
-
-        return left_data < right_data
+    def sort(self, column, order=Qt.AscendingOrder):
+        # rows are sorted in source model, proxy keeps their order
+        self.sourceModel().sort(column, order)
 
     def flags(self, index):
         if not index.isValid():
@@ -94,6 +97,105 @@ class TableModel(QAbstractTableModel):
         self.__data = []
         self.__user_data = []
         self.column_count = 0
+        self._source = None         # iterator of rows not fetched yet - lazy mode
+        self._convert = None
+        self._count = None
+        self._total = None
+        self._order_by = None
+        self._sort = None           # (column, order) of last sort
+
+    def set_source(self, rows, convert, count=None, order_by=None):
+        """
+        Lazy mode: rows of model are replaced with rows taken from iterator
+        by chunks of FETCH_CHUNK when view needs them (canFetchMore / fetchMore)
+        :param rows: iterable, e.g. cursor of its own
+        :param convert: function: row of source -> (row, user_data)
+        :param count: function: total number of rows, it is called only
+                      if rows are not exhausted by the first chunk
+        :param order_by: function: (column, order) -> rows sorted by column,
+                         used instead of rows if model is sorted,
+                         without it rows are sorted by model
+        :return: None
+        """
+        if self._sort and order_by:
+            TableModel._close(rows)
+            rows = order_by(*self._sort)
+        self.close_source()
+        self.beginResetModel()
+        self._clear_rows()
+        self.endResetModel()
+        self._source = iter(rows)
+        self._convert = convert
+        self._count = count
+        self._order_by = order_by
+        self._total = None
+        self.fetchMore()
+        if self._sort and not order_by:
+            self.sort(*self._sort)
+
+    def set_sort(self, column, order):
+        """
+        Sort order of rows of next set_source, e.g. sort order
+        of previous model shown in the same view
+        :param column:
+        :param order:
+        :return: None
+        """
+        self._sort = (column, order)
+
+    def close_source(self):
+        """
+        Stop lazy fetching, close cursor of source
+        :return: None
+        """
+        TableModel._close(self._source)
+        self._source = None
+
+    @staticmethod
+    def _close(rows):
+        if hasattr(rows, 'close'):
+            rows.close()
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._source is not None
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        chunk = list(islice(self._source, FETCH_CHUNK))
+        if len(chunk) < FETCH_CHUNK:
+            self.close_source()
+        if chunk:
+            first = self.rowCount()
+            self.beginInsertRows(QModelIndex(), first, first + len(chunk) - 1)
+            self._add_rows(map(self._convert, chunk))
+            self.endInsertRows()
+
+    def _add_rows(self, rows):
+        """
+        :param rows: iterable of (row, user_data)
+        """
+        for row, user_data in rows:
+            self.__data.append(TableModel._str_row(row))
+            self.__user_data.append(user_data)
+
+    def _clear_rows(self):
+        self.__data.clear()
+        self.__user_data.clear()
+
+    def fetch_all(self):
+        while self._source is not None:
+            self.fetchMore()
+
+    def total_count(self):
+        """
+        :return: number of rows including not fetched yet
+        """
+        if self._source is None or self._count is None:
+            return self.rowCount()
+        if self._total is None:
+            self._total = self._count()
+        return self._total
 
     def rowCount(self, parent=QModelIndex()):
         if parent.isValid():
@@ -145,18 +247,16 @@ class TableModel(QAbstractTableModel):
 
     def append_row(self, row, user_data=None):
         self.beginInsertRows(QModelIndex(), self.rowCount(), self.rowCount())
-        if isinstance(row, str) or not isinstance(row, Iterable):
-            row = (str(row),)
-        else:
-            rr = []
-            for r in row:
-                rr.append(str(r))
-            row = tuple(rr)
-
-        self.__data.append(row)
+        self.__data.append(TableModel._str_row(row))
         self.__user_data.append(user_data)
         self.endInsertRows()
 
+    @staticmethod
+    def _str_row(row):
+        if isinstance(row, str) or not isinstance(row, Iterable):
+            return (str(row),)
+        return tuple(str(r) for r in row)
+
     def insert_row(self, index, row_data, user_data=None):
         if index.isValid():
             row = index.row()
@@ -209,6 +309,263 @@ class TableModel(QAbstractTableModel):
         return ()
 
 
+class _Column:
+    """
+    Column of FileTableModel: values are kept in typed array and
+    formatted only when shown. If some value can't be converted the
+    column falls back to list of interned strings
+    """
+    __slots__ = ('values', 'to_value', 'to_str')
+
+    def __init__(self, typecode=None, to_value=None, to_str=str):
+        """
+        :param typecode: of array, None - text column
+        :param to_value: function: value from DB or editor -> array item,
+                         for text column - str, default is interned str
+        :param to_str: function: array item -> displayed text
+        """
+        if typecode:
+            self.values = array(typecode)
+            self.to_value = to_value
+            self.to_str = to_str
+        else:
+            self.values = []
+            self.to_value = to_value or _Column._text
+            self.to_str = str
+
+    def __getitem__(self, row):
+        return self.to_str(self.values[row])
+
+    def __setitem__(self, row, value):
+        try:
+            self.values[row] = self.to_value(value)
+        except (TypeError, ValueError, OverflowError):
+            self._as_text()
+            self.values[row] = self.to_value(value)
+
+    def __delitem__(self, key):
+        del self.values[key]
+
+    def append(self, value):
+        try:
+            self.values.append(self.to_value(value))
+        except (TypeError, ValueError, OverflowError):
+            self._as_text()
+            self.values.append(self.to_value(value))
+
+    def extend(self, values):
+        try:
+            self.values.extend([self.to_value(v) for v in values])
+        except (TypeError, ValueError, OverflowError):
+            self._as_text()
+            self.values.extend([self.to_value(v) for v in values])
+
+    def insert(self, row, value):
+        self.append(value)
+        self.values.insert(row, self.values.pop())
+
+    def _as_text(self):
+        self.values = [intern(self.to_str(v)) for v in self.values]
+        self.to_value = _Column._text
+        self.to_str = str
+
+    @staticmethod
+    def _text(value):
+        return intern(str(value))
+
+
+def _date_ordinal(value):
+    """
+    :param value: date, as selected from DATE column with PARSE_DECLTYPES,
+                  or 'YYYY-MM-DD'
+    :return: ordinal of date, ValueError if it can't be restored
+             by _date_str exactly
+    """
+    if isinstance(value, date):
+        if isinstance(value, datetime):
+            raise ValueError(value)
+        return value.toordinal()
+    return _str_ordinal(value)
+
+
+@lru_cache(maxsize=DATE_CACHE)
+def _str_ordinal(value):
+    if len(value) != 10 or value[4] != '-' or value[7] != '-':
+        raise ValueError(value)
+    return date(int(value[:4]), int(value[5:7]), int(value[8:])).toordinal()
+
+
+@lru_cache(maxsize=DATE_CACHE)
+def _date_str(ordinal):
+    return date.fromordinal(ordinal).isoformat()
+
+
+def _name_column():
+    return _Column(to_value=str)      # names are unique, interning costs memory
+
+
+def _int_column():
+    return _Column('i', int)
+
+
+def _size_column():
+    return _Column('q', int)
+
+
+def _date_column():
+    return _Column('i', _date_ordinal, _date_str)
+
+
+# column of file list by header, other columns are text
+FILE_COLUMNS = {'File': _name_column, 'Date': _date_column, 'Pages': _int_column,
+                'Size': _size_column, 'Issued': _date_column, 'Commented': _date_column}
+
+FILE_DATA_TYPES = 'qiiiii'  # typecodes of arrays for FileData fields
+
+
+class FileTableModel(TableModel):
+    """
+    File list stored by columns: numbers and dates in typed arrays,
+    names as strings, other text as interned strings, FileData fields
+    in arrays of integers. Text is formatted in data(), cell is updated
+    in place
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._columns = []
+        self._user_data = [array(code) for code in FILE_DATA_TYPES]
+
+    def setHeaderData(self, p_int, orientation, value, role=None):
+        super().setHeaderData(p_int, orientation, value, role)
+        self._columns = [FILE_COLUMNS.get(head, _Column)() for head in self.header]
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """
+        If not all rows are fetched and source can be ordered, rows are
+        selected again sorted by SQLite. Otherwise fetched rows are
+        sorted by permutation of row numbers: values of column are
+        the sort keys, numbers and dates compared as numbers
+        """
+        if not 0 <= column < len(self._columns):
+            self._sort = None           # keep order of source
+            return
+        self._sort = (column, order)
+        if self._source is not None and self._order_by:
+            self.set_source((), self._convert, self._count, self._order_by)
+            return
+
+        self.fetch_all()
+        keys = self._columns[column].values
+        perm = sorted(range(len(keys)), key=keys.__getitem__,
+                      reverse=(order == Qt.DescendingOrder))
+        self.layoutAboutToBeChanged.emit()
+        for col in self._columns:
+            col.values = FileTableModel._permuted(col.values, perm)
+        self._user_data = [FileTableModel._permuted(col, perm) for col in self._user_data]
+
+        new_rows = array('q', bytes(8 * len(perm)))
+        for new, old in enumerate(perm):
+            new_rows[old] = new
+        old_idx = self.persistentIndexList()
+        self.changePersistentIndexList(old_idx, [self.index(new_rows[idx.row()], idx.column())
+                                                 for idx in old_idx])
+        self.layoutChanged.emit()
+
+    @staticmethod
+    def _permuted(values, perm):
+        if len(perm) < 2:
+            return values
+        res = itemgetter(*perm)(values)
+        if isinstance(values, array):
+            return array(values.typecode, res)
+        return list(res)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._user_data[0])
+
+    def in_real_folder(self, index):
+        return self._user_data[-1][index.row()] == 0
+
+    def data(self, index, role=Qt.DisplayRole):
+        if index.isValid():
+            if role == Qt.DisplayRole:
+                if index.column() < len(self._columns):
+                    return self._columns[index.column()][index.row()]
+                return None
+            elif role == Qt.UserRole:
+                return self._file_data(index.row())
+            elif role == Qt.TextAlignmentRole:
+                if index.column() == 0:
+                    return Qt.AlignLeft
+                return Qt.AlignRight
+
+    def update(self, index, data, role=Qt.DisplayRole):
+        if index.isValid():
+            if role == Qt.DisplayRole:
+                if index.column() < len(self._columns):
+                    self._columns[index.column()][index.row()] = data
+            elif role == Qt.UserRole:
+                for column, value in zip(self._user_data, data):
+                    column[index.row()] = value
+
+    def setData(self, index, value, role):
+        self.update(index, value, role)
+
+    def delete_row(self, index):
+        if index.isValid():
+            self.removeRows(index.row())
+
+    def removeRows(self, row, count=1, parent=QModelIndex()):
+        self.beginRemoveRows(QModelIndex(), row, row + count - 1)
+        for column in self._columns + self._user_data:
+            del column[row:row + count]
+        self.endRemoveRows()
+        return True
+
+    def append_row(self, row, user_data=None):
+        self.beginInsertRows(QModelIndex(), self.rowCount(), self.rowCount())
+        self._add_rows(((row, user_data),))
+        self.endInsertRows()
+
+    def insert_row(self, index, row_data, user_data=None):
+        if not index.isValid():
+            self.append_row(row_data, user_data)
+            return
+        row = index.row()
+        self.beginInsertRows(QModelIndex(), row, row)
+        for column, value in zip(self._columns, row_data):
+            column.insert(row, value)
+        for column, value in zip(self._user_data, user_data):
+            column.insert(row, value)
+        self.endInsertRows()
+
+    def get_row(self, row):
+        if 0 <= row < self.rowCount():
+            return (tuple(column[row] for column in self._columns), self._file_data(row))
+        return ()
+
+    def _add_rows(self, rows):
+        """
+        :param rows: iterable of (row, FileData), row - values of columns
+        """
+        rows = tuple(rows)
+        if rows:
+            values, user_data = zip(*rows)
+            for column, column_values in zip(self._columns, zip(*values)):
+                column.extend(column_values)
+            for column, column_values in zip(self._user_data, zip(*user_data)):
+                column.extend(column_values)
+
+    def _clear_rows(self):
+        for column in self._columns + self._user_data:
+            del column[:]
+
+    def _file_data(self, row):
+        return FileData._make(column[row] for column in self._user_data)
+
+
 class TableModel2(TableModel):
     """
     for edit tags / authors assigned to file
@@ -1,19 +1,61 @@
 # controller/tree_model.py
 
-import copy
+from collections import Counter, defaultdict
 
 from PyQt5.QtCore import Qt, QAbstractItemModel, QModelIndex
 
 
+def build_tree(root, rows, new_item):
+    """
+    Attach items created from rows to root. Item is created for each row,
+    so the same ID with several parents (e.g. virtual folder) gets its own
+    item and subtree in each parent, no items are copied
+    :param root: item with ID 0
+    :param rows: see set_model_data, any order
+    :param new_item: function: (data_, user_data) -> item
+    :return: None
+    """
+    children = defaultdict(list)
+    used = Counter()
+    for row in rows:
+        if not isinstance(row[0], tuple):
+            row = ((row[0],),) + tuple(row[1:])
+        children[row[2]].append(row)
+        used[row[1]] += 1
+
+    stack = [(root, 0)]
+    while stack:
+        parent, parent_id = stack.pop()
+        for row in children.get(parent_id, ()):
+            # item used several times may be ancestor of itself
+            if used[row[1]] > 1 and _has_ancestor(parent, row[1]):
+                continue
+            item = new_item(row[0], row[1:])
+            parent.appendChild(item)
+            stack.append((item, row[1]))
+
+
+def _has_ancestor(item, id_):
+    while item is not None:
+        if item.userData and item.userData[0] == id_:
+            return True
+        item = item.parent()
+    return False
+
+
 class TreeItem(object):
+    __slots__ = ('parentItem', 'userData', 'itemData', 'childItems', '_row')
+
     def __init__(self, data_, user_data=None, parent=None):
         self.parentItem = parent
         self.userData = user_data
         self.itemData = data_
         self.childItems = []
+        self._row = 0                   # position in childItems of parent
 
     def appendChild(self, item):
         item.parentItem = self          # does not run if parent is not set ???
+        item._row = len(self.childItems)
         self.childItems.append(item)
 
     def child(self, row):
@@ -40,10 +82,7 @@ class TreeItem(object):
         return self.parentItem
 
     def row(self):
-        if self.parentItem:
-            return self.parentItem.childItems.index(self)
-
-        return 0
+        return self._row
 
     def set_data(self, data_):
         self.itemData = data_
@@ -128,18 +167,8 @@ class TreeModel(QAbstractItemModel):
                   item[1]  - Id of item, unique,
                   item[2]  - Id of parent item, 0 for root,
                         ...
-             and sorted by item(2) - parent ID - in descendant order
+             children of item are in order of rows
         :return: None
         """
-        id_list = []
-        items_dict = {0: self.rootItem}
-        for row in rows:
-            if not isinstance(row[0], tuple):
-                row = ((row[0],),) + tuple(row[1:])
-            items_dict[row[1]] = TreeItem(data_=row[0], user_data=(row[1:]))
-            id_list.append((row[1:]))
-
-        for id_ in id_list:
-            if id_[1] in items_dict:
-                # use copy because the same item may used in different branches
-                items_dict[id_[1]].appendChild(copy.deepcopy(items_dict[id_[0]]))
+        build_tree(self.rootItem, rows,
+                   lambda data_, user_data: TreeItem(data_=data_, user_data=user_data))
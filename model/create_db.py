@@ -3,6 +3,8 @@
 import socket
 import sqlite3
 
+MAX_DEPTH = 255         # protection against cycles in Dirs.ParentID
+
 OBJ_DEFS = (
     '''CREATE TABLE IF NOT EXISTS Files (
 FileID INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
@@ -17,6 +19,9 @@ Size INTEGER not null default 0,
 IssueDate DATE not null default '0001-01-01',
 Opened TEXT not null default '0001-01-01',
 Commented DATE not null default '0001-01-01',
+MTime REAL,
+PartHash TEXT,
+Hash TEXT,
 FOREIGN KEY(DirID) REFERENCES Dirs(DirID),
 FOREIGN KEY(CommentID) REFERENCES Comments(CommentID),
 FOREIGN KEY(ExtID) REFERENCES Extensions(ExtID)
@@ -59,9 +64,47 @@ Path TEXT,
 PlaceId INTEGER,
 ParentID INTEGER,
 isVirtual INTEGER,
+Stamp TEXT,
 FOREIGN KEY(ParentID) REFERENCES Dirs(DirID) ON DELETE CASCADE
 );''',
 
+    # closure of Dirs.ParentID: all (ancestor, descendant) pairs with distance,
+    # every dir is its own ancestor with Depth 0, DirID 0 is ancestor of all
+    '''CREATE TABLE IF NOT EXISTS DirTree (
+Ancestor INTEGER NOT NULL,
+Descendant INTEGER NOT NULL,
+Depth INTEGER NOT NULL,
+PRIMARY KEY(Ancestor, Descendant)
+) WITHOUT ROWID;''',
+    'CREATE INDEX IF NOT EXISTS DirTree_Descendant ON DirTree(Descendant);',
+
+    '''CREATE TRIGGER IF NOT EXISTS DirTree_insert AFTER INSERT ON Dirs
+BEGIN
+insert or replace into DirTree (Ancestor, Descendant, Depth)
+select Ancestor, new.DirID, Depth + 1 from DirTree where Descendant = new.ParentID
+union all select new.DirID, new.DirID, 0;
+END;''',
+
+    '''CREATE TRIGGER IF NOT EXISTS DirTree_move AFTER UPDATE OF ParentID ON Dirs
+WHEN old.ParentID IS NOT new.ParentID
+BEGIN
+delete from DirTree
+where Descendant in (select Descendant from DirTree where Ancestor = new.DirID)
+and Ancestor in (select Ancestor from DirTree where Descendant = new.DirID
+and Ancestor <> new.DirID);
+insert or replace into DirTree (Ancestor, Descendant, Depth)
+select p.Ancestor, c.Descendant, p.Depth + c.Depth + 1 from DirTree p, DirTree c
+where p.Descendant = new.ParentID and c.Ancestor = new.DirID;
+END;''',
+
+    # subdirectories of deleted dir are cut off the tree, as with ParentID
+    '''CREATE TRIGGER IF NOT EXISTS DirTree_delete AFTER DELETE ON Dirs
+BEGIN
+delete from DirTree
+where Descendant in (select Descendant from DirTree where Ancestor = old.DirID)
+and Ancestor in (select Ancestor from DirTree where Descendant = old.DirID);
+END;''',
+
     '''CREATE TABLE IF NOT EXISTS Extensions (
 ExtID INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
 Extension TEXT,
@@ -100,12 +143,121 @@ FOREIGN KEY(DirID) REFERENCES Dirs(DirID) ON DELETE CASCADE
 
     'CREATE INDEX IF NOT EXISTS Dirs_PlaceId ON Dirs(PlaceId, DirID);',
     'CREATE INDEX IF NOT EXISTS Dirs_ParentID ON Dirs(ParentID);',
+    'CREATE INDEX IF NOT EXISTS VirtDirs_ParentID ON VirtDirs(ParentID);',
     'CREATE INDEX IF NOT EXISTS Files_ExtID ON Files(PlaceId, ExtID);',
     'CREATE INDEX IF NOT EXISTS Files_DirID ON Files(PlaceId, DirID);',
+    'CREATE INDEX IF NOT EXISTS Files_Size ON Files(Size, PartHash);',
+    'CREATE INDEX IF NOT EXISTS Files_Hash ON Files(Hash);',
     'CREATE INDEX IF NOT EXISTS LogIdx ON Log(ActTime desc)',
     'CREATE INDEX IF NOT EXISTS LogIdx ON Log(ObjID, ActTime desc)'
 )
 
+# full text index of files: rowid is FileID. Triggers only queue changed
+# FileIDs in FtsPending, sync_fts applies the queue by two set statements:
+# fts5 flushes its pending terms at the start of each nested statement,
+# so its update by trigger for every inserted row is ~10 times slower
+FTS_DEFS = (
+    ' '.join(('CREATE VIRTUAL TABLE IF NOT EXISTS FilesFTS USING fts5(',
+              'FileName, BookTitle, Comment, Tags, Authors,',
+              "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3');")),
+
+    'CREATE TABLE IF NOT EXISTS FtsPending (FileID INTEGER NOT NULL PRIMARY KEY);',
+
+    '''CREATE TRIGGER IF NOT EXISTS FilesFTS_insert AFTER INSERT ON Files
+BEGIN
+insert or ignore into FtsPending (FileID) values (new.FileID);
+END;''',
+
+    '''CREATE TRIGGER IF NOT EXISTS FilesFTS_update AFTER UPDATE OF FileName, CommentID ON Files
+BEGIN
+insert or ignore into FtsPending (FileID) values (new.FileID);
+END;''',
+
+    '''CREATE TRIGGER IF NOT EXISTS FilesFTS_delete AFTER DELETE ON Files
+BEGIN
+insert or ignore into FtsPending (FileID) values (old.FileID);
+END;''',
+
+    '''CREATE TRIGGER IF NOT EXISTS FilesFTS_comment AFTER UPDATE OF Comment, BookTitle ON Comments
+BEGIN
+insert or ignore into FtsPending (FileID)
+select FileID from Files where CommentID = new.CommentID;
+END;''',
+
+    '''CREATE TRIGGER IF NOT EXISTS FilesFTS_tag_insert AFTER INSERT ON FileTag
+BEGIN
+insert or ignore into FtsPending (FileID) values (new.FileID);
+END;''',
+
+    '''CREATE TRIGGER IF NOT EXISTS FilesFTS_tag_delete AFTER DELETE ON FileTag
+BEGIN
+insert or ignore into FtsPending (FileID) values (old.FileID);
+END;''',
+
+    '''CREATE TRIGGER IF NOT EXISTS FilesFTS_tag_rename AFTER UPDATE OF Tag ON Tags
+BEGIN
+insert or ignore into FtsPending (FileID)
+select FileID from FileTag where TagID = new.TagID;
+END;''',
+
+    '''CREATE TRIGGER IF NOT EXISTS FilesFTS_author_insert AFTER INSERT ON FileAuthor
+BEGIN
+insert or ignore into FtsPending (FileID) values (new.FileID);
+END;''',
+
+    '''CREATE TRIGGER IF NOT EXISTS FilesFTS_author_delete AFTER DELETE ON FileAuthor
+BEGIN
+insert or ignore into FtsPending (FileID) values (old.FileID);
+END;''',
+
+    '''CREATE TRIGGER IF NOT EXISTS FilesFTS_author_rename AFTER UPDATE OF Author ON Authors
+BEGIN
+insert or ignore into FtsPending (FileID)
+select FileID from FileAuthor where AuthorID = new.AuthorID;
+END;''',
+)
+
+# rows of FilesFTS for files selected by condition {}
+FTS_ROWS = ' '.join(('insert into FilesFTS (rowid, FileName, BookTitle, Comment, Tags, Authors)',
+                     'select f.FileID, f.FileName, c.BookTitle, c.Comment,',
+                     "(select group_concat(t.Tag, ' ') from FileTag x, Tags t",
+                     'where x.FileID = f.FileID and t.TagID = x.TagID),',
+                     "(select group_concat(a.Author, ' ') from FileAuthor x, Authors a",
+                     'where x.FileID = f.FileID and a.AuthorID = x.AuthorID)',
+                     'from Files f left join Comments c on c.CommentID = f.CommentID',
+                     'where {};'))
+
+SYNC_FTS = (
+    'delete from FilesFTS where rowid in (select FileID from FtsPending);',
+    FTS_ROWS.format('f.FileID in (select FileID from FtsPending)'),
+    'delete from FtsPending;',
+)
+
+REBUILD_FTS = (
+    'delete from FilesFTS;',
+    FTS_ROWS.format('1'),
+    'delete from FtsPending;',
+)
+
+REBUILD_DIR_TREE = (
+    'delete from DirTree;',
+    ' '.join(('insert into DirTree (Ancestor, Descendant, Depth)',
+              'with recursive x(Ancestor, Descendant, Depth) as',
+              '(select DirID, DirID, 0 from Dirs where DirID <> 0',
+              'union all select 0, 0, 0',
+              'union all select x.Ancestor, d.DirID, x.Depth + 1 from x, Dirs d',
+              'where d.ParentID = x.Descendant and d.DirID <> 0 and x.Depth < {})',
+              'select * from x;')).format(MAX_DEPTH),
+)
+
+# columns added to tables of data base created by previous versions
+NEW_COLUMNS = (
+    ('Dirs', 'Stamp', 'TEXT'),      # fingerprint of directory: mtime|entries|extensions
+    ('Files', 'MTime', 'REAL'),     # st_mtime of file when its info was loaded
+    ('Files', 'PartHash', 'TEXT'),  # blake2b of first and last PART_SIZE bytes
+    ('Files', 'Hash', 'TEXT'),      # blake2b of whole file
+)
+
 
 def create_all_objects(connection):
     cursor = connection.cursor()
@@ -116,9 +268,98 @@ def create_all_objects(connection):
             print("An error occurred:", err.args[0])
             print(obj)
 
+    create_fts(connection)
     initiate_db(connection)
 
 
+def update_db(connection):
+    """
+    Add to the existing data base the objects created by later versions
+    :param connection:
+    :return: None
+    """
+    cursor = connection.cursor()
+    for table, column, col_type in NEW_COLUMNS:
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info({});'.format(table))]
+        if columns and column not in columns:
+            cursor.execute('ALTER TABLE {} ADD COLUMN {} {};'.format(table, column, col_type))
+
+    for obj in OBJ_DEFS:
+        try:
+            cursor.execute(obj)
+        except sqlite3.Error as err:
+            print("An error occurred:", err.args[0])
+            print(obj)
+
+    if cursor.execute('select count(*) from DirTree;').fetchone()[0] == 0:
+        rebuild_dir_tree(connection)
+    if create_fts(connection) and cursor.execute(
+            'select not exists (select 1 from FilesFTS) and exists (select 1 from Files);'
+    ).fetchone()[0]:
+        rebuild_fts(connection)
+    connection.commit()
+
+
+def rebuild_dir_tree(connection):
+    """
+    Fill DirTree from Dirs.ParentID, for data base created by previous
+    version or if DirTree is out of sync
+    :param connection:
+    :return: None
+    """
+    cursor = connection.cursor()
+    for sql in REBUILD_DIR_TREE:
+        cursor.execute(sql)
+    connection.commit()
+
+
+def create_fts(connection):
+    """
+    Create full text index FilesFTS and triggers to keep it in sync
+    :param connection:
+    :return: True if sqlite3 library supports fts5
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(FTS_DEFS[0])
+    except sqlite3.Error as err:
+        print("Full text search is not available:", err.args[0])
+        return False
+
+    for obj in FTS_DEFS[1:]:
+        cursor.execute(obj)
+    return True
+
+
+def sync_fts(connection):
+    """
+    Apply changes of files queued by triggers to FilesFTS
+    :param connection:
+    :return: None
+    """
+    cursor = connection.cursor()
+    try:
+        if not cursor.execute('select exists (select 1 from FtsPending);').fetchone()[0]:
+            return
+    except sqlite3.OperationalError:     # no full text index
+        return
+    for sql in SYNC_FTS:
+        cursor.execute(sql)
+    connection.commit()
+
+
+def rebuild_fts(connection):
+    """
+    Fill FilesFTS for data base created by previous version
+    :param connection:
+    :return: None
+    """
+    cursor = connection.cursor()
+    for sql in REBUILD_FTS:
+        cursor.execute(sql)
+    connection.commit()
+
+
 def initiate_db(connection):
     cursor = connection.cursor()
     loc = socket.gethostname()
@@ -0,0 +1,91 @@
+# model/dir_index.py
+
+import os
+
+
+class _Node:
+    __slots__ = ('dir_id', 'parent_id', 'children')
+
+    def __init__(self):
+        self.dir_id = 0         # 0 - path is not in Dirs table
+        self.parent_id = 0
+        self.children = {}
+
+
+class DirIndex:
+    """
+    In-memory trie of real directories of one place:
+      components of Dirs.Path -> (DirID, ParentID)
+    Replaces per-level FIND_EXACT_PATH queries and 'like path%' scans
+    """
+    def __init__(self, rows=()):
+        """
+        :param rows: iterable of (Path, DirID, ParentID)
+        """
+        self._root = _Node()
+        for path, dir_id, parent_id in rows:
+            if path:
+                node = self._node(path, create=True)
+                node.dir_id = dir_id
+                node.parent_id = parent_id
+
+    def find(self, path):
+        """
+        :param path:
+        :return: DirID of path or 0 if path is not in index
+        """
+        node = self._node(path)
+        return node.dir_id if node else 0
+
+    def closest_parent(self, path):
+        """
+        Search the directory itself or its closest parent
+        :param path:
+        :return: tuple of ID and path of parent directory or (0, '')
+        """
+        res = (0, '')
+        node = self._root
+        parts = path.split(os.altsep) if path else []
+        for i, part in enumerate(parts):
+            node = node.children.get(part)
+            if node is None:
+                break
+            if node.dir_id:
+                res = (node.dir_id, os.altsep.join(parts[:i + 1]))
+        return res
+
+    def add(self, path, dir_id, parent_id):
+        """
+        Add new directory into index
+        :param path:
+        :param dir_id:
+        :param parent_id: - DirID of closest parent
+        :return: list of DirIDs of subdirectories that get dir_id as parent,
+                 only those with the same parent_id as the new directory
+        """
+        node = self._node(path, create=True)
+        node.dir_id = dir_id
+        node.parent_id = parent_id
+
+        children = []
+        stack = list(node.children.values())
+        while stack:
+            child = stack.pop()
+            if child.dir_id:
+                if child.parent_id == parent_id:
+                    child.parent_id = dir_id
+                    children.append(child.dir_id)
+            else:
+                stack.extend(child.children.values())
+        return children
+
+    def _node(self, path, create=False):
+        node = self._root
+        for part in path.split(os.altsep):
+            child = node.children.get(part)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[part] = _Node()
+            node = child
+        return node
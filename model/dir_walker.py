@@ -0,0 +1,169 @@
+# model/dir_walker.py
+
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from model.helper import get_file_extension
+
+WORKERS = 4             # threads scanning directories
+QUEUE_SIZE = 10000      # max number of found files waiting for consumer
+
+WorkerStat = namedtuple('WorkerStat', 'name dirs skipped files seconds')
+
+
+class DirWalker:
+    """
+    Directory tree walker, subdirectories are scanned by os.scandir
+    in a pool of threads. Iteration gives tuples
+        (directory path, file name, os.stat_result)
+    Found files are passed through a bounded queue, so the memory
+    does not depend on the size of tree.
+    Each directory gets a fingerprint (stamp): mtime, number of entries
+    and extensions filter. Files of directory are not reported if
+    is_unchanged(dir, stamp) returns True, subdirectories are scanned anyway
+    """
+    def __init__(self, root, extensions, workers=WORKERS, queue_size=QUEUE_SIZE,
+                 is_unchanged=None):
+        """
+        :param root: root directory
+        :param extensions: comma separated list of extensions, '*' or '' - all files
+        :param workers: number of threads
+        :param queue_size: max number of files in queue
+        :param is_unchanged: function(dir path, stamp) -> bool, called from threads
+        """
+        self.root = root
+        if (not extensions) | (extensions == '*'):
+            self.ext_ = None
+        else:
+            self.ext_ = tuple(x.strip('. ') for x in extensions.split(','))
+        self.ext_stamp = ','.join(sorted(self.ext_)) if self.ext_ else '*'
+        self.is_unchanged = is_unchanged
+        self.stamps = {}        # dir path -> stamp, for dirs reported as changed
+        self.workers = max(1, workers)
+        self._dirs = queue.Queue()
+        self._files = queue.Queue(maxsize=queue_size)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._stats = [[0, 0, 0, 0.0] for _ in range(self.workers)]   # dirs, skipped, files, seconds
+
+    def __iter__(self):
+        self._start()
+        finished = 0
+        try:
+            while finished < self.workers:
+                item = self._files.get()
+                if item is None:        # worker is finished
+                    finished += 1
+                else:
+                    yield item
+        finally:
+            self.close()
+
+    def get_counters(self):
+        """
+        Throughput counters of workers
+        :return: list of WorkerStat(name, dirs, skipped, files, seconds)
+        """
+        return [WorkerStat('worker-{}'.format(i), *stat)
+                for i, stat in enumerate(self._stats)]
+
+    def close(self):
+        """
+        Stop workers, used when consumer breaks iteration
+        :return: None
+        """
+        if not self._stop.is_set():
+            self._stop.set()
+            for _ in self._threads:
+                self._dirs.put(None)
+
+    def _start(self):
+        self._pending = 1
+        self._dirs.put(self.root)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, args=(i,), daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _work(self, num):
+        stat = self._stats[num]
+        while not self._stop.is_set():
+            dir_ = self._dirs.get()
+            if dir_ is None:
+                break
+            start = time.perf_counter()
+            files = self._scan_dir(dir_)
+            stat[0] += 1
+            if files < 0:
+                stat[1] += 1
+            else:
+                stat[2] += files
+            stat[3] += time.perf_counter() - start
+            self._dir_done()
+        self._put(None)
+
+    def _scan_dir(self, dir_):
+        """
+        Put files of dir_ into queue of files and its subdirectories
+        into queue of dirs
+        :param dir_:
+        :return: number of files found, -1 if dir_ is unchanged
+        """
+        try:
+            # stat before listing: change during listing makes stamp differ next time
+            mtime = os.stat(dir_).st_mtime_ns
+            with os.scandir(dir_) as entries:
+                entries = list(entries)
+        except OSError:      # like os.walk, skip unreadable directories
+            return 0
+
+        files = []
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        self._add_dir(entry.path)
+                elif self.ext_ is None or get_file_extension(entry.name) in self.ext_:
+                    files.append(entry)
+            except OSError:
+                pass
+
+        stamp = '{}|{}|{}'.format(mtime, len(entries), self.ext_stamp)
+        if self.is_unchanged and self.is_unchanged(dir_, stamp):
+            return -1
+
+        count = 0
+        for entry in files:
+            try:
+                self._put((dir_, entry.name, entry.stat()))
+                count += 1
+            except OSError:
+                pass
+        self.stamps[dir_] = stamp
+        return count
+
+    def _add_dir(self, path):
+        with self._lock:
+            self._pending += 1
+        self._dirs.put(path)
+
+    def _dir_done(self):
+        with self._lock:
+            self._pending -= 1
+            all_done = self._pending == 0
+        if all_done:
+            for _ in range(self.workers):
+                self._dirs.put(None)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._files.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
@@ -0,0 +1,216 @@
+# model/file_hash.py
+
+import hashlib
+import os
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtCore import pyqtSignal, QObject, pyqtSlot
+
+from controller.places import Places
+from model.helper import Shared
+
+PART_SIZE = 64 * 1024   # bytes hashed at the start and at the end of file
+CHUNK_SIZE = 1 << 20    # read size for full hash
+DIGEST_SIZE = 20
+WORKERS = 4             # threads reading and hashing files
+READ_AHEAD = 16         # files submitted to threads ahead of consumer
+READ_BATCH = 2000       # number of files read from DB in one query
+WRITE_BATCH = 200       # number of files updated in one transaction
+
+# files of place with the same size as some other file of any place,
+# '+' - scan by FileID instead of sorting all files of place for each page
+PART_HASH_TODO = ' '.join(('select f.FileID, d.Path, f.FileName, f.Size from Files f, Dirs d',
+                           'where d.DirID = f.DirID and +f.PlaceId = :place and f.Size > 0',
+                           'and f.PartHash is null and f.FileID > :file',
+                           'and exists (select 1 from Files g where g.Size = f.Size',
+                           'and g.FileID <> f.FileID)',
+                           'order by f.FileID limit :limit;'))
+
+# files of place with the same size and partial hash as some other file
+FULL_HASH_TODO = ' '.join(('select f.FileID, d.Path, f.FileName, f.Size from Files f, Dirs d',
+                           'where d.DirID = f.DirID and f.PlaceId = :place',
+                           'and f.Hash is null and f.PartHash is not null and f.FileID > :file',
+                           'and exists (select 1 from Files g where g.Size = f.Size',
+                           'and g.PartHash = f.PartHash and g.FileID <> f.FileID)',
+                           'order by f.FileID limit :limit;'))
+
+UPDATE_PART_HASH = 'update Files set PartHash = :part, Hash = :hash where FileID = :file_id;'
+
+UPDATE_HASH = 'update Files set Hash = :hash where FileID = :file_id;'
+
+DUPLICATE_GROUPS = ' '.join(('select count(*), coalesce(sum(n), 0) from (select count(*) n',
+                             'from Files where Hash is not null group by Hash',
+                             'having count(*) > 1);'))
+
+hash_file = namedtuple('hash_file', 'file_id full_name size')
+
+
+def part_hash(full_name, size):
+    """
+    Hash of first and last PART_SIZE bytes, for small file
+    it is the hash of whole file, the same as full_hash
+    :param full_name:
+    :param size: file size stored in DB
+    :return: hex digest or None if file is changed or unreadable
+    """
+    hasher = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    with open(full_name, 'rb') as file_:
+        if os.fstat(file_.fileno()).st_size != size:
+            return None
+        if size <= 2 * PART_SIZE:
+            hasher.update(file_.read())
+        else:
+            hasher.update(file_.read(PART_SIZE))
+            file_.seek(-PART_SIZE, os.SEEK_END)
+            hasher.update(file_.read(PART_SIZE))
+    return hasher.hexdigest()
+
+
+def full_hash(full_name, size):
+    """
+    :param full_name:
+    :param size: file size stored in DB
+    :return: hex digest or None if file is changed or unreadable
+    """
+    hasher = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(full_name, 'rb', buffering=0) as file_:
+        if os.fstat(file_.fileno()).st_size != size:
+            return None
+        while True:
+            length = file_.readinto(buffer)
+            if not length:
+                break
+            hasher.update(view[:length])
+    return hasher.hexdigest()
+
+
+class FileHash(QObject):
+    """
+    Content hashes of files of current place, used to find duplicates.
+    Only files with the same size as another file (in any place) get
+    partial hash, only files with the same size and partial hash get
+    full hash. Hashes are committed by batches and computed only
+    where they are null, so interrupted hashing continues next time.
+    Hashes are cleared by FileInfo when size or mtime of file is changed
+    """
+    finished = pyqtSignal()
+    progress = pyqtSignal(int, int)     # number of hashed files, number of found files
+
+    def __init__(self, place_inst, workers=WORKERS):
+        """
+        :param place_inst: Places
+        :param workers: number of threads
+        """
+        super().__init__()
+        print('--> FileHash.__init__')
+        self.places = place_inst
+        self.workers = workers
+        self.conn = Shared['DB utility'].open_writer() or Shared['DB connection']
+        self.cursor = self.conn.cursor()
+        self._done = 0
+        self._found = 0
+        self.groups = (0, 0)           # duplicate groups, files in them
+
+    @pyqtSlot()
+    def run(self):
+        print('--> FileHash.run')
+        try:
+            self.hash_files()
+        finally:
+            Shared['DB utility'].close_connection(self.conn)
+        self.finished.emit()
+
+    def hash_files(self):
+        """
+        :return: None
+        """
+        place_id = self.places.get_curr_place().id_
+        if self.places.get_disk_state() == Places.MOUNTED:
+            root = self.places.get_mount_point()
+            full_path = lambda x: os.altsep.join((root, x))
+        else:
+            full_path = lambda x: x
+
+        self._update(place_id, full_path, full=False)
+        self._update(place_id, full_path, full=True)
+        self.groups = self.cursor.execute(DUPLICATE_GROUPS).fetchone()
+
+    def get_groups(self):
+        return self.groups
+
+    def _update(self, place_id, full_path, full):
+        """
+        :param place_id:
+        :param full_path: function: path in DB -> real path
+        :param full: False - partial hashes, True - full hashes
+        :return: None
+        """
+        todo_sql, hash_func, update_sql = ((FULL_HASH_TODO, full_hash, UPDATE_HASH) if full else
+                                           (PART_HASH_TODO, part_hash, UPDATE_PART_HASH))
+        rows = []
+        for file_, digest in self._hash_all(self._todo(todo_sql, place_id, full_path), hash_func):
+            self._done += 1
+            if digest is None:
+                continue
+            rows.append({'file_id': file_.file_id,
+                         'part': digest,
+                         'hash': digest if full or file_.size <= 2 * PART_SIZE else None})
+            if len(rows) >= WRITE_BATCH:
+                self._flush(update_sql, rows)
+        self._flush(update_sql, rows)
+
+    def _flush(self, update_sql, rows):
+        if rows:
+            self.cursor.executemany(update_sql, rows)
+            self.conn.commit()
+            rows.clear()
+        self.progress.emit(self._done, self._found)
+
+    def _todo(self, todo_sql, place_id, full_path):
+        """
+        Files to be hashed, read by pages from separate read connection
+        :return: generator of hash_file
+        """
+        dbu = Shared['DB utility']
+        reader = dbu.open_reader() or self.conn
+        try:
+            key = {'place': place_id, 'file': -1, 'limit': READ_BATCH}
+            while True:
+                rows = reader.execute(todo_sql, key).fetchall()
+                self._found += len(rows)
+                for file_id, path, name, size in rows:
+                    yield hash_file(file_id, os.path.join(full_path(path), name), size)
+                if len(rows) < READ_BATCH:
+                    break
+                key['file'] = rows[-1][0]
+        finally:
+            if reader is not self.conn:
+                dbu.close_connection(reader)
+
+    def _hash_all(self, files, hash_func):
+        """
+        Hash files in pool of threads, up to READ_AHEAD files are read
+        ahead of consumer, results are in order of files
+        :param files: iterable of hash_file
+        :param hash_func: part_hash or full_hash
+        :return: generator of (hash_file, hex digest or None)
+        """
+        in_flight = deque()
+        with ThreadPoolExecutor(self.workers) as pool:
+            for file_ in files:
+                in_flight.append((file_, pool.submit(hash_func, file_.full_name, file_.size)))
+                if len(in_flight) >= READ_AHEAD:
+                    yield FileHash._result(*in_flight.popleft())
+            while in_flight:
+                yield FileHash._result(*in_flight.popleft())
+
+    @staticmethod
+    def _result(file_, future):
+        try:
+            return file_, future.result()
+        except OSError as e:
+            print('--> FileHash, EXCEPTION', file_.full_name, e)
+            return file_, None
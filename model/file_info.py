@@ -1,189 +1,188 @@
 # model/file_info.py
 
 import os
-from collections import namedtuple
-import datetime
 import re
+import time
+from collections import namedtuple, deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 
-from PyPDF2 import PdfFileReader, utils
 from PyQt5.QtCore import pyqtSignal, QObject, pyqtSlot
 
 from controller.places import Places
-from model.helper import Shared, get_file_extension
+from model.helper import Shared
 from model.load_db_data import LoadDBData
+from model.pdf_info import get_file_info, get_stat_info, is_pdf, NO_DATE
 
-AUTHOR_ID = 'select AuthorID from Authors where Author = ?;'
+INSERT_FILEAUTHOR = 'insert or ignore into FileAuthor (FileID, AuthorID) values (?, ?);'
 
-INSERT_AUTHOR = 'insert into Authors (Author) values (?);'
+SELECT_COMMENT = 'select BookTitle from Comments where CommentID=?;'
 
-FILE_AUTHOR = 'select * from FileAuthor where FileID=? and AuthorID=?'
+INSERT_COMMENT = 'insert into Comments (BookTitle, Comment) values (?, ?);'
 
-INSERT_FILEAUTHOR = 'insert into FileAuthor (FileID, AuthorID) values (?, ?);'
+LOAD_DIRS = 'create temp table if not exists LoadDirs (DirID INTEGER PRIMARY KEY);'
 
-SELECT_COMMENT = 'select BookTitle from Comments where CommentID=?;'
+CLEAR_LOAD_DIRS = 'delete from LoadDirs;'
 
-INSERT_COMMENT = 'insert into Comments (BookTitle, Comment) values (?, ?);'
+INSERT_LOAD_DIR = 'insert or ignore into LoadDirs (DirID) values (?);'
+
+COUNT_IN_LOAD = 'select count(*) from Files where PlaceId = ? and DirID in LoadDirs;'
 
-FILES_IN_LOAD = ' '.join(('select f.FileID, f.FileName, d.Path, f.CommentID,',
-                          'f.IssueDate, f.Pages from Files f, Dirs d',
-                          'where f.DirID = d.DirID and d.DirID in ({});'))
+# one page of files, keyset pagination by (DirID, FileID)
+FILES_IN_LOAD = ' '.join(('select f.FileID, f.FileName, d.Path, f.Size, f.MTime,',
+                          'f.CommentID, f.IssueDate, f.Pages, f.DirID from Files f, Dirs d',
+                          'where d.DirID = f.DirID and f.PlaceId = :place',
+                          'and f.DirID in (select DirID from LoadDirs where DirID >= :dir)',
+                          'and (f.DirID > :dir or f.FileID > :file)',
+                          'order by f.DirID, f.FileID limit :limit;'))
 
 UPDATE_FILE = ' '.join(('update Files set',
                         'CommentID = :comm_id,',
                         'FileDate = :date,',
                         'Pages = :page,',
                         'Size = :size,',
-                        'IssueDate = :issue_date',
+                        'IssueDate = :issue_date,',
+                        'PartHash = case when Size = :size and MTime = :mtime then PartHash end,',
+                        'Hash = case when Size = :size and MTime = :mtime then Hash end,',
+                        'MTime = :mtime',
                         'where FileID = :file_id;'))
 
+PDF_TIMEOUT = 60        # seconds, max time to parse one pdf file
+WRITE_BATCH = 500       # number of files updated in one transaction
+READ_BATCH = 2000       # number of files read from DB in one query
+
 
 class LoadFiles(QObject):
     finished = pyqtSignal()
 
-    def __init__(self, cur_place, path_, ext_):
+    def __init__(self, cur_place, path_, ext_, incremental=True):
         super().__init__()
         print('--> LoadFiles.__init__')
         self.cur_place = cur_place
-        self.conn = Shared['DB connection']
         self.path_ = path_
         self.ext_ = ext_
+        self.incremental = incremental
         self.updated_dirs = None
+        self.changes = None
+        self.tree_changes = None
 
     @pyqtSlot()
     def run(self):
         print('--> LoadFiles.run')
-        files = LoadDBData(self.cur_place)
-        files.load_data(self.path_, self.ext_)
+        dbu = Shared['DB utility']
+        conn = dbu.open_writer()
+        try:
+            files = LoadDBData(self.cur_place, connection=conn)
+            files.load_data(self.path_, self.ext_, self.incremental)
+            dbu.sync_fts(conn)
+        finally:
+            dbu.close_connection(conn)
+        for stat in files.get_walk_stats():
+            print('    ', stat)
         self.updated_dirs = files.get_updated_dirs()
+        self.changes = files.get_changes()
+        self.tree_changes = files.get_tree_changes()
         self.finished.emit()
 
     def get_updated_dirs(self):
         return self.updated_dirs
 
+    def get_changes(self):
+        return self.changes
+
+    def get_tree_changes(self):
+        return self.tree_changes
+
 
 class FileInfo(QObject):
     finished = pyqtSignal()
+    progress = pyqtSignal(int, int)     # number of checked files, total number
 
     @pyqtSlot()
     def run(self):
         print('--> FileInfo.run')
-        self._update_files()
+        try:
+            self._update_files()
+            Shared['DB utility'].sync_fts(self.conn)
+        finally:
+            Shared['DB utility'].close_connection(self.conn)
         self.finished.emit()           # 'Updating of files is finished'
 
-    def __init__(self, place_inst, updated_dirs):
+    def __init__(self, place_inst, updated_dirs, workers=None, force=False):
+        """
+        :param place_inst: Places
+        :param updated_dirs: DirIDs of dirs to update
+        :param workers: number of processes parsing pdf files, default - number of cores
+        :param force: update also files with unchanged size and mtime
+        """
         super().__init__()
         print('--> FileInfo.__init__')
         self.upd_dirs = updated_dirs
         self.places = place_inst
-        self.conn = Shared['DB connection']
+        self.workers = workers or os.cpu_count() or 1
+        self.force = force
+        self.conn = Shared['DB utility'].open_writer() or Shared['DB connection']
         self.cursor = self.conn.cursor()
+        self.authors = Shared['DB utility'].get_lookup('author')
         self.file_info = []
+        self._file_rows = []        # UPDATE_FILE parameters
+        self._author_rows = []      # (FileID, AuthorID)
+        self._checked = 0           # files of updated dirs checked for change
+        self._total = 0             # files in updated dirs
 
     def _insert_author(self, file_id):
         authors = re.split(r',|;|&|\band\b', self.file_info[3])
         for author in authors:
-            aut = author.strip()
-            auth_idl = self.cursor.execute(AUTHOR_ID, (aut,)).fetchone()
-            if not auth_idl:
-                self.cursor.execute(INSERT_AUTHOR, (aut,))
-                self.conn.commit()
-                auth_id = self.cursor.lastrowid
-            else:
-                auth_id = auth_idl[0]
-                check = self.cursor.execute(FILE_AUTHOR, (file_id, auth_id))
-                if check:
-                    return
-            self.cursor.execute(INSERT_FILEAUTHOR, (file_id, auth_id))
-            self.conn.commit()
+            auth_id = self.authors.intern(author.strip())
+            self._author_rows.append((file_id, auth_id))
 
     def _insert_comment(self, _file):
         if len(self.file_info) > 2:
-            try:
-                pages = self.file_info[2]
-                issue_date = self.file_info[4]
-                book_title = self.file_info[5]
-            except IndexError:
-                print('IndexError ', len(self.file_info))
-            else:
-                self.cursor.execute(INSERT_COMMENT, (book_title, ''))
-                self.conn.commit()
-                comm_id = self.cursor.lastrowid
+            pages = self.file_info[2]
+            issue_date = self.file_info[4]
+            book_title = self.file_info[5]
+            self.cursor.execute(INSERT_COMMENT, (book_title, ''))
+            comm_id = self.cursor.lastrowid
         else:
             comm_id = _file.comment_id
             pages = _file.pages
             issue_date = _file.issue_date
         return comm_id, pages, issue_date
 
-    def _get_file_info(self, full_file_name):
+    def _update_file(self, file_, file_info):
         """
-        Store info in self.file_info
-        :param full_file_name:
+        Update file info in tables Files, Authors and Comments,
+        rows are written by _flush
+        :param file_: file_id, full_name, mtime, comment_id, issue_date, pages
+        :param file_info: [size, date, pages, author, issue_date, title]
         :return: None
         """
-        self.file_info.clear()
-        if os.path.isfile(full_file_name):
-            st = os.stat(full_file_name)
-            self.file_info.append(st.st_size)
-            self.file_info.append(datetime.datetime.fromtimestamp(st.st_mtime).date().isoformat())
-            if get_file_extension(full_file_name) == 'pdf':
-                self._get_pdf_info(full_file_name)
-        else:
-            self.file_info.append('')
-            self.file_info.append('')
-
-    def _get_pdf_info(self, file_):
-        with (open(file_, "rb")) as pdf_file:
-            try:
-                fr = PdfFileReader(pdf_file, strict=False)
-                fi = fr.documentInfo
-                self.file_info.append(fr.getNumPages())
-            except (ValueError, utils.PdfReadError, utils.PdfStreamError) as e:
-                print('--> _get_pdf_info, EXCEPTION', e)
-                self.file_info += [0, '', '', '']
-            else:
-                if fi is not None:
-                    self.file_info.append(fi.getText('/Author'))
-                    self.file_info.append(FileInfo._pdf_creation_date(fi))
-                    self.file_info.append(fi.getText('/Title'))
-                else:
-                    self.file_info += ['', '', '']
-
-    @staticmethod
-    def _pdf_creation_date(fi):
-        ww = fi.getText('/CreationDate')
-        if ww:
-            tt = '-'.join((ww[2:6], ww[6:8], ww[8:10]))
-            try:
-                datetime.datetime.strptime(tt, '%Y-%m-%d')
-            except ValueError:
-                tt = '0001-01-01'
-            return tt
-        return '0001-01-01'
-
-    def _update_file(self, file_):
-        """
-        Update file info in tables Files, Authors and Comments
-        :param file_: file_id, full_name, comment_id, issue_date, pages
-        :return: None
-        """
-        self._get_file_info(file_.full_name)
+        self.file_info = file_info
         if file_.comment_id is None:
             comm_id, pages, issue_date = self._insert_comment(file_)
         else:
             comm_id = file_.comment_id
             pages = file_.pages
-            issue_date = file_.issue_date if file_.issue_date else '0001-01-01'
-
-        self.cursor.execute(UPDATE_FILE, {'comm_id': comm_id,
-                                          'date': self.file_info[1],
-                                          'page': pages,
-                                          'size': self.file_info[0],
-                                          'issue_date': issue_date,
-                                          'file_id': file_.file_id})
-        self.conn.commit()
+            issue_date = file_.issue_date if file_.issue_date else NO_DATE
+
+        self._file_rows.append({'comm_id': comm_id,
+                                'date': self.file_info[1],
+                                'page': pages,
+                                'size': self.file_info[0],
+                                'issue_date': issue_date,
+                                'mtime': file_.mtime,
+                                'file_id': file_.file_id})
         if len(self.file_info) > 3 and self.file_info[3]:
             self._insert_author(file_.file_id)
 
+    def _flush(self):
+        self.authors.flush(self.cursor)
+        self.cursor.executemany(INSERT_FILEAUTHOR, self._author_rows)
+        self.cursor.executemany(UPDATE_FILE, self._file_rows)
+        self.conn.commit()
+        self._author_rows.clear()
+        self._file_rows.clear()
+
     def _update_files(self):
         cur_place = self.places.get_curr_place()
         if cur_place[2] == Places.MOUNTED:
@@ -192,13 +191,146 @@ class FileInfo(QObject):
         else:
             full_path = lambda x: x
 
+        files = self._changed_files(cur_place.id_, full_path)
+        for done, (file_, file_info) in enumerate(self._extract(files), 1):
+            self._update_file(file_, file_info)
+            if done % WRITE_BATCH == 0:
+                self._flush()
+                self.progress.emit(self._checked, self._total)
+        self._flush()
+
+    def _changed_files(self, place_id, full_path):
+        """
+        Files of updated dirs that are new or changed. Updated dirs are
+        staged in temp table of separate read connection, files are read
+        by pages, so memory does not depend on number of files, and
+        the read lock is not held while changes are written
+        :param place_id:
+        :param full_path: function: path in DB -> real path
+        :return: generator of db_file_info
+        """
         db_file_info = namedtuple('db_file_info',
-                                  'file_id full_name comment_id issue_date pages')
-
-        dir_ids = ','.join(self.upd_dirs)
-        file_list = self.cursor.execute(FILES_IN_LOAD.format(dir_ids)).fetchall()
-        # not iterate all rows in cursor - so used fetchall(), why ???
-        for it in file_list:
-            file_name = os.path.join(full_path(it[2]), it[1])
-            file_ = db_file_info._make((it[0], file_name) + it[-3:])
-            self._update_file(file_)
+                                  'file_id full_name mtime comment_id issue_date pages')
+        dbu = Shared['DB utility']
+        reader = dbu.open_reader() or self.conn
+        try:
+            reader.execute(LOAD_DIRS)
+            reader.execute(CLEAR_LOAD_DIRS)
+            reader.executemany(INSERT_LOAD_DIR, ((int(x),) for x in self.upd_dirs))
+            reader.commit()
+            self._total = reader.execute(COUNT_IN_LOAD, (place_id,)).fetchone()[0]
+
+            key = {'place': place_id, 'dir': -1, 'file': -1, 'limit': READ_BATCH}
+            while True:
+                rows = reader.execute(FILES_IN_LOAD, key).fetchall()
+                for it in rows:
+                    self._checked += 1
+                    file_name = os.path.join(full_path(it[2]), it[1])
+                    mtime = self._changed_mtime(file_name, it[3], it[4])
+                    if mtime is not None:
+                        yield db_file_info._make((it[0], file_name, mtime) + it[5:8])
+                if len(rows) < READ_BATCH:
+                    break
+                key['dir'], key['file'] = rows[-1][-1], rows[-1][0]
+        finally:
+            if reader is not self.conn:
+                dbu.close_connection(reader)
+
+    def _changed_mtime(self, file_name, size, mtime):
+        """
+        Compare size and mtime of file with stored in DB
+        :param file_name:
+        :param size: - Files.Size
+        :param mtime: - Files.MTime
+        :return: st_mtime if file is new or changed or self.force, None otherwise
+        """
+        try:
+            st = os.stat(file_name)
+        except OSError:
+            return 0.0 if self.force or mtime is None else None
+        if self.force or (size, mtime) != (st.st_size, st.st_mtime):
+            return st.st_mtime
+        return None
+
+    def _extract(self, files):
+        """
+        Collect file info, pdf files are parsed in a pool of processes.
+        A file that hangs longer than PDF_TIMEOUT or crashes the worker
+        process gets only size and date
+        :param files: iterable of db_file_info
+        :return: generator of (db_file_info, file info list)
+        """
+        pending = deque()   # pdf files to be submitted
+        retry = deque()     # files from broken pool, submitted one by one
+        in_flight = {}      # future -> (file_, start time)
+        pool = None
+        files = iter(files)
+        try:
+            while True:
+                for file_ in files:
+                    if is_pdf(file_.full_name):
+                        pending.append(file_)
+                        if len(pending) >= self.workers:
+                            break
+                    else:
+                        yield file_, get_file_info(file_.full_name)
+                if not (pending or retry or in_flight):
+                    break
+
+                if pool is None:
+                    pool = ProcessPoolExecutor(self.workers)
+                queue_, limit = (retry, 1) if retry else (pending, self.workers)
+                while queue_ and len(in_flight) < limit:
+                    file_ = queue_.popleft()
+                    in_flight[pool.submit(get_file_info, file_.full_name)] = (file_, time.time())
+
+                done, _ = wait(in_flight, timeout=PDF_TIMEOUT, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    file_, _ = in_flight.pop(future)
+                    try:
+                        yield file_, future.result()
+                    except BrokenProcessPool:
+                        broken = True
+                        if limit == 1:          # crashed alone - it is the culprit
+                            print('--> FileInfo._extract, worker crashed', file_.full_name)
+                            yield file_, FileInfo._stat_only(file_)
+                        else:
+                            retry.append(file_)
+                    except Exception as e:
+                        print('--> FileInfo._extract, EXCEPTION', file_.full_name, e)
+                        yield file_, FileInfo._stat_only(file_)
+
+                if not done:                    # some worker hangs
+                    now = time.time()
+                    for file_, start in in_flight.values():
+                        if now - start >= PDF_TIMEOUT:
+                            print('--> FileInfo._extract, timeout', file_.full_name)
+                            yield file_, FileInfo._stat_only(file_)
+                        else:
+                            pending.appendleft(file_)
+                    in_flight.clear()
+                    broken = True
+                elif broken:                    # the rest of broken pool to be checked
+                    retry.extend(file_ for file_, _ in in_flight.values())
+                    in_flight.clear()
+
+                if broken:
+                    FileInfo._kill_pool(pool)
+                    pool = None
+        finally:
+            if pool:
+                pool.shutdown()
+
+    @staticmethod
+    def _stat_only(file_):
+        # file that hung, crashed or failed in pool must not be parsed again here
+        return get_stat_info(file_.full_name)
+
+    @staticmethod
+    def _kill_pool(pool):
+        # ProcessPoolExecutor has no public way to stop a hanging worker
+        processes = getattr(pool, '_processes', None) or {}
+        for process in list(processes.values()):
+            process.terminate()
+        pool.shutdown(wait=False)
@@ -7,6 +7,7 @@ from PyQt5.QtGui import QFontDatabase
 # immutable
 EXT_ID_INCREMENT = 100000
 Fields = namedtuple('Fields', 'fields headers indexes')
+FileData = namedtuple('FileData', 'file_id dir_id comment_id ext_id place_id source')
 
 real_folder, virtual_folder, file_real, file_virtual = range(4)
 MimeTypes = ["application/x-folder-list",
@@ -1,42 +1,70 @@
 # model/load_db_data.py
 
 import os
+from collections import namedtuple
+
 from controller.places import Places
-from model.helper import Shared, get_file_extension, get_parent_dir
+from model.dir_index import DirIndex
+from model.dir_walker import DirWalker, WORKERS
+from model.helper import Shared, get_file_extension
+
+PLACE_DIRS = 'select Path, DirID, ParentID from Dirs where PlaceId = ? and isVirtual = 0;'
 
-FIND_PART_PATH = 'select ParentID from Dirs where Path like :newPath and PlaceId = :place;'
+CHANGE_PARENT_ID = 'update Dirs set ParentID = ? where DirID = ?;'
 
-FIND_EXACT_PATH = 'select DirID, Path from Dirs where Path = :newPath and PlaceId = :place;'
+FILES_IN_DIR = 'select FileName, Size, MTime from Files where DirID = ?;'
 
-CHANGE_PARENT_ID = '''update Dirs set ParentID = :newId
- where ParentID = :currId and Path like :newPath and DirID != :newId;'''
+STAMPED_DIRS = 'select Path, DirID, Stamp from Dirs where PlaceId = ? and Stamp is not null;'
 
-FIND_FILE = 'select * from Files where DirID = :dir_id and FileName = :file;'
+UPDATE_STAMP = 'update Dirs set Stamp = ? where DirID = ?;'
 
 INSERT_DIR = 'insert into Dirs (Path, ParentID, PlaceId, isVirtual) values (:path, :id, :placeId, 0);'
 
 INSERT_FILE = 'insert into Files (DirID, FileName, ExtID, PlaceId) values (:dir_id, :file, :ext_id, :placeId);'
 
-FIND_EXT = 'select ExtID from Extensions where Extension = ?;'
+BATCH_SIZE = 5000     # number of Files rows written in one transaction
 
-INSERT_EXT = 'insert into Extensions (Extension, GroupID) values (:ext, 0);'
+# added - number of new files; removed, modified - lists of (path, file name)
+ScanChanges = namedtuple('ScanChanges', 'added removed modified')
+
+# new - list of DirIDs of inserted dirs; moved - {DirID: ParentID before move}
+TreeChanges = namedtuple('TreeChanges', 'new moved')
 
 
 class LoadDBData:
     """
     class LoadDBData
     """
-    def __init__(self, current_place: Places.CurrPlace):
+    def __init__(self, current_place: Places.CurrPlace, batch_size=BATCH_SIZE,
+                 workers=WORKERS, connection=None):
         """
         class LoadDBData
-        :param connection: - connection to database
+        :param current_place: - place where files are loaded from
+        :param batch_size: - number of Files rows inserted by one executemany
+        :param workers: - number of threads scanning directories
+        :param connection: - writer connection of worker, default - connection of GUI
         """
-        self.conn = Shared['DB connection']
+        self.conn = connection or Shared['DB connection']
         self.cursor = self.conn.cursor()
         self.place_id = current_place.idx
         self.place_status = current_place.disk_state
         self.insert_current_place(current_place)
         self.updated_dirs = set()
+        self.batch_size = batch_size
+        self._dir_ids = {}      # path -> DirID of dirs met while loading
+        self._dir_index = None  # DirIndex of all real dirs of place, built on first use
+        self._parent_rows = []  # (ParentID, DirID) to be updated in Dirs
+        self._dir_files = {}    # DirID -> {file name: (Size, MTime)} of files in DB
+        self._ext_ids = Shared['DB utility'].get_lookup('ext')
+        self._file_rows = []    # Files rows waiting for executemany
+        self.workers = workers
+        self.walker = None
+        self._stamps = {}       # path -> (DirID, Stamp) stored by previous scans
+        self._seen = {}         # DirID -> names of files found in stamped dir
+        self._incremental = True
+        self._trantab = str.maketrans(os.sep, os.altsep)
+        self.changes = ScanChanges(0, [], [])
+        self.tree_changes = TreeChanges([], {})
 
     def insert_current_place(self, current_place: Places.CurrPlace):
         '''
@@ -56,96 +84,246 @@ class LoadDBData:
     def get_updated_dirs(self):
         return self.updated_dirs
 
-    def load_data(self, path_, ext_):
+    def get_changes(self):
+        """
+        Changes found by the last load_data
+        :return: ScanChanges(added, removed, modified)
+        """
+        return self.changes
+
+    def get_tree_changes(self):
+        """
+        Dirs inserted and dirs that got new parent since this object is
+        created, to update directory tree without reloading it
+        :return: TreeChanges(new, moved)
+        """
+        return self.tree_changes
+
+    def get_walk_stats(self):
+        """
+        Throughput counters of threads used in the last load_data
+        :return: list of WorkerStat(name, dirs, skipped, files, seconds)
+        """
+        return self.walker.get_counters() if self.walker else []
+
+    def load_data(self, path_, ext_, incremental=True):
         """
         Load data in data base
-        :param data: - iterable lines of file names with full path
+          rows of Files are collected into batches of self.batch_size
+          and inserted by executemany, one transaction per batch.
+          If incremental, files are compared with DB only in directories
+          whose fingerprint (Dirs.Stamp) is changed since previous scan
+        :param path_: - root directory to scan
+        :param ext_: - comma separated extensions, '*' or '' - all files
+        :param incremental: - skip directories with unchanged fingerprint,
+                              False - compare files of all directories, e.g.
+                              to find files edited in place: it changes neither
+                              mtime of directory nor number of its entries
         :return: None
         """
-        files = LoadDBData._yield_files(path_, ext_)
-        trantab = str.maketrans(os.sep, os.altsep)
-        for line in files:
-            line = line.translate(trantab)
-            if self.place_status == Places.MOUNTED:
-                # path without disk letter for removable disks
-                line = line.partition(os.altsep)[2]
-            path = line.rpartition(os.altsep)[0]
-            idx = self.insert_dir(path)
+        self._incremental = incremental
+        self._load_stamps()
+        self.changes = ScanChanges(0, [], [])
+        self.walker = DirWalker(path_, ext_, self.workers,
+                                is_unchanged=self._is_unchanged)
+        for dir_, file_, st in self.walker:
+            path = self._db_path(dir_)
+            idx = self._get_dir_id(path)
             self.updated_dirs.add(str(idx))
-            self.insert_file(idx, line)
+            if idx in self._seen:
+                self._seen[idx].add(file_)
+            if self.insert_file(idx, file_, st):
+                self.changes.modified.append((path, file_))
+            if len(self._file_rows) >= self.batch_size:
+                self._flush_files()
+        self._flush_files()
+        self._save_stamps()
+
+    def _db_path(self, dir_):
+        """
+        Path of directory as it is stored in Dirs table
+        :param dir_: path from file system
+        :return: path
+        """
+        path = dir_.translate(self._trantab).rstrip(os.altsep)
+        if self.place_status == Places.MOUNTED:
+            # path without disk letter for removable disks
+            path = path.partition(os.altsep)[2]
+        return path
+
+    def _load_stamps(self):
+        self._stamps = {row[0]: (row[1], row[2]) for row in
+                        self.cursor.execute(STAMPED_DIRS, (self.place_id,))}
+
+    def _is_unchanged(self, dir_, stamp):
+        """
+        Called by DirWalker threads
+        :param dir_: path from file system
+        :param stamp: current fingerprint of directory
+        :return: True if fingerprint is the same as stored in DB
+                 and scan is incremental
+        """
+        stored = self._stamps.get(self._db_path(dir_))
+        if stored is None:
+            return False
+        if stored[1] == stamp and self._incremental:
+            return True
+        self._seen[stored[0]] = set()
+        return False
+
+    def _save_stamps(self):
+        """
+        Store fingerprints of scanned directories, report removed files
+        :return: None
+        """
+        stamps = []
+        for dir_, stamp in self.walker.stamps.items():
+            path = self._db_path(dir_)
+            idx = self._dir_ids.get(path) or self._stamps.get(path, (None,))[0]
+            if idx:
+                stamps.append((stamp, idx))
+                if idx in self._seen:
+                    self._find_removed(idx, path)
+        self.cursor.executemany(UPDATE_STAMP, stamps)
         self.conn.commit()
 
-    def insert_file(self, dir_id, full_file_name):
+    def _find_removed(self, dir_id, path):
+        ext_ = self.walker.ext_
+        for file_ in self._files_in_dir(dir_id):
+            if file_ not in self._seen[dir_id]:
+                if ext_ is None or get_file_extension(file_) in ext_:
+                    self.changes.removed.append((path, file_))
+
+    def _flush_files(self):
         """
-        Insert file into Files table
-        :param dir_id:
-        :param full_file_name:
+        Write collected Files rows and commit the transaction
         :return: None
         """
-        file_ = os.path.split(full_file_name)[1]
+        self._flush_parents()
+        self._ext_ids.flush(self.cursor)
+        if self._file_rows:
+            self.cursor.executemany(INSERT_FILE, self._file_rows)
+            self.changes = self.changes._replace(
+                added=self.changes.added + len(self._file_rows))
+            self._file_rows.clear()
+        self.conn.commit()
+        # inserted files are in DB now, reload them on demand
+        self._dir_files.clear()
 
-        item = self.cursor.execute(FIND_FILE, {'dir_id': dir_id, 'file': file_}).fetchone()
-        if not item:
+    def insert_file(self, dir_id, file_, st=None):
+        """
+        Add file into batch of rows to be inserted into Files table
+        :param dir_id:
+        :param file_: file name without path
+        :param st: os.stat_result of file, to check if the file is modified
+        :return: True if file is already in DB and it is modified
+        """
+        files_in_dir = self._files_in_dir(dir_id)
+        if file_ not in files_in_dir:
             ext_id, ext = self.insert_extension(file_)
             if ext_id > 0:      # files with an empty extension are not handled
-                self.cursor.execute(INSERT_FILE, {'dir_id': dir_id,
-                                                  'file': file_,
-                                                  'ext_id': ext_id,
-                                                  'placeId': self.place_id})
+                files_in_dir[file_] = None
+                self._file_rows.append({'dir_id': dir_id,
+                                        'file': file_,
+                                        'ext_id': ext_id,
+                                        'placeId': self.place_id})
+            return False
+        return bool(st) and LoadDBData._is_modified(files_in_dir[file_], st)
+
+    @staticmethod
+    def _is_modified(stored, st):
+        """
+        :param stored: (Size, MTime) from Files table
+        :param st: os.stat_result
+        :return: True if size or mtime differ, False if not or file info was not loaded yet
+        """
+        if not stored or stored[1] is None:
+            return False
+        return stored != (st.st_size, st.st_mtime)
+
+    def _files_in_dir(self, dir_id):
+        """
+        Files of directory, one query per directory instead of per file
+        :param dir_id:
+        :return: dict {file name: (Size, MTime)}
+        """
+        if dir_id not in self._dir_files:
+            self._dir_files[dir_id] = {
+                row[0]: row[1:] for row in self.cursor.execute(FILES_IN_DIR, (dir_id,))}
+        return self._dir_files[dir_id]
 
     def insert_extension(self, file):
+        """
+        Get ExtID of file extension, a new extension is written
+        into DB with the batch of files
+        :param file:
+        :return: (ExtID, extension), ExtID = 0 for files without extension
+        """
         ext = get_file_extension(file)
         if ext:
-            item = self.cursor.execute(FIND_EXT, (ext,)).fetchone()
-            if item:
-                idx = item[0]
-            else:
-                self.cursor.execute(INSERT_EXT, {'ext': ext})
-                idx = self.cursor.lastrowid
-                self.conn.commit()
+            idx = self._ext_ids.intern(ext)
         else:
             idx = 0
         return idx, ext
 
+    def _get_dir_id(self, path):
+        """
+        DirID of path, the Dirs table is searched only once per directory
+        :param path:
+        :return: DirID
+        """
+        idx = self._dir_ids.get(path)
+        if idx is None:
+            idx = self._insert_dir(path)
+            self._dir_ids[path] = idx
+        return idx
+
     def insert_dir(self, path):
         '''
         Insert directory into Dirs table
         :param path:
         :return: row ID of file dir
         '''
+        idx = self._insert_dir(path)
+        self._flush_parents()
+        self.conn.commit()
+        return idx
+
+    def _insert_dir(self, path):
+        '''
+        Insert directory into Dirs table without commit
+        :param path:
+        :return: row ID of file dir
+        '''
         idx, parent_path = self.search_closest_parent(path)
         if parent_path == path:
             return idx
 
         self.cursor.execute(INSERT_DIR, {'path': path, 'id': idx, 'placeId': self.place_id})
-        idx = self.cursor.lastrowid
-
-        self.change_parent(idx, path)
-        self.conn.commit()
-        return idx
+        new_idx = self.cursor.lastrowid
+        self.tree_changes.new.append(new_idx)
 
-    def change_parent(self, new_parent_id, path):
-        old_parent_id = self.parent_id_for_child(path)
-        if old_parent_id != -1:
-            self.cursor.execute(CHANGE_PARENT_ID, {'currId': old_parent_id,
-                                                       'newId': new_parent_id,
-                                                       'newPath': path + '%'})
+        self.change_parent(new_idx, path, idx)
+        return new_idx
 
-    def parent_id_for_child(self, path):
-        '''
-        Check the new file path:
-          if it can be parent for other directories
-        :param path:
-        :return: parent Id of first found child, -1 if not children
-        '''
-        item = self.cursor.execute(FIND_PART_PATH, {'newPath': path + '%',
-                                                        'place': self.place_id}).fetchone()
-        if item:
-            idx = item[0]
-        else:
-            idx = -1
+    def change_parent(self, new_parent_id, path, old_parent_id):
+        """
+        New directory becomes parent of its subdirectories that have the
+        same parent as the new one. Dirs rows are updated by _flush_parents
+        :param new_parent_id: DirID of new directory
+        :param path: path of new directory
+        :param old_parent_id: ParentID of new directory
+        :return: None
+        """
+        children = self._get_dir_index().add(path, new_parent_id, old_parent_id)
+        self._parent_rows.extend((new_parent_id, child) for child in children)
+        for child in children:
+            self.tree_changes.moved.setdefault(child, old_parent_id)
 
-        return idx
+    def _flush_parents(self):
+        if self._parent_rows:
+            self.cursor.executemany(CHANGE_PARENT_ID, self._parent_rows)
+            self._parent_rows.clear()
 
     def search_closest_parent(self, path):
         '''
@@ -153,32 +331,12 @@ class LoadDBData:
         :param path:  file path
         :return:  tuple of ID and path of parent directory or (0, '')
         '''
-        res = (0, '')
-        while path:
-            item = self.cursor.execute(FIND_EXACT_PATH, (path, self.place_id)).fetchone()
-            if item:
-                res = tuple(item)
-                break
-            path = get_parent_dir(path)
-        return res
+        return self._get_dir_index().closest_parent(path)
 
-    @staticmethod
-    def _yield_files(root, extensions):
-        """
-        generator of file list
-        :param root: root directory
-        :param extensions: list of extensions
-        :return: generator
-        """
-        ext_ = tuple(x.strip('. ') for x in extensions.split(','))
-        for dir_name, _, file_names in os.walk(root):
-            if (not extensions) | (extensions == '*'):
-                for filename in file_names:
-                    yield os.path.join(dir_name, filename)
-            else:
-                for filename in file_names:
-                    if get_file_extension(filename) in ext_:
-                        yield os.path.join(dir_name, filename)
+    def _get_dir_index(self):
+        if self._dir_index is None:
+            self._dir_index = DirIndex(self.cursor.execute(PLACE_DIRS, (self.place_id,)))
+        return self._dir_index
 
 
 if __name__ == "__main__":
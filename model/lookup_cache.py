@@ -0,0 +1,246 @@
+# model/lookup_cache.py
+
+import json
+import threading
+from collections import namedtuple, OrderedDict
+
+# name: (select all, select last used ID, insert with ID)
+Lookups = {'ext': ('select Extension, ExtID from Extensions;',
+                   ' '.join(('select max(coalesce((select seq from sqlite_sequence',
+                             "where name = 'Extensions'), 0),",
+                             'coalesce((select max(ExtID) from Extensions), 0));')),
+                   'insert or ignore into Extensions (ExtID, Extension, GroupID) values (?, ?, 0);'),
+           'author': ('select Author, AuthorID from Authors;',
+                      ' '.join(('select max(coalesce((select seq from sqlite_sequence',
+                                "where name = 'Authors'), 0),",
+                                'coalesce((select max(AuthorID) from Authors), 0));')),
+                      'insert or ignore into Authors (AuthorID, Author) values (?, ?);'),
+           'tag': ('select Tag, TagID from Tags;',
+                   ' '.join(('select max(coalesce((select seq from sqlite_sequence',
+                             "where name = 'Tags'), 0),",
+                             'coalesce((select max(TagID) from Tags), 0));')),
+                   'insert or ignore into Tags (TagID, Tag) values (?, ?);')
+           }
+
+# paths of set of dirs, DirIDs as JSON array
+DIR_PATHS = 'select DirID, Path, PlaceId from Dirs where DirID in (select value from json_each(?));'
+
+DETAIL_SIZE = 2000      # files held in detail cache
+
+# details of set of files, FileIDs as JSON array: one query per table
+FILE_DETAILS = {'tags': ' '.join(('select ft.FileID, t.Tag from FileTag ft, Tags t',
+                                  'where ft.FileID in (select value from json_each(?))',
+                                  'and t.TagID = ft.TagID order by t.TagID;')),
+                'authors': ' '.join(('select fa.FileID, a.Author from FileAuthor fa, Authors a',
+                                     'where fa.FileID in (select value from json_each(?))',
+                                     'and a.AuthorID = fa.AuthorID order by a.AuthorID;')),
+                'comments': ' '.join(('select f.FileID, c.Comment, c.BookTitle',
+                                      'from Files f, Comments c',
+                                      'where f.FileID in (select value from json_each(?))',
+                                      'and c.CommentID = f.CommentID;'))}
+
+file_details = namedtuple('file_details', 'tags authors comment title')
+
+
+class LookupCache:
+    """
+    Interning cache: name -> ID for Extensions, Authors and Tags tables.
+    Loaded from DB on first use. A new name gets its ID at once,
+    the row is written later by flush (write-behind), so the caller
+    must flush before commit. Each thread flushes only names interned
+    by itself, through its own connection; a name interned by several
+    threads before it is written is inserted by each of them, the
+    second insert is ignored
+    """
+    def __init__(self, connection, lookup):
+        """
+        :param connection:
+        :param lookup: key of Lookups: 'ext', 'author' or 'tag'
+        """
+        self.conn = connection
+        self.sql = Lookups[lookup]
+        self._ids = None
+        self._last_id = 0
+        self._pending = {}      # thread -> {name: ID} interned by thread
+        self._unwritten = {}    # name -> ID of names not flushed yet by any thread
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """
+        :param name:
+        :return: ID or None if name is unknown
+        """
+        with self._lock:
+            self._load()
+            return self._ids.get(name)
+
+    def intern(self, name):
+        """
+        :param name:
+        :return: ID of name, new ID is assigned if name is unknown
+        """
+        with self._lock:
+            self._load()
+            idx = self._ids.get(name)
+            if idx is None:
+                self._last_id += 1
+                idx = self._last_id
+                self._ids[name] = idx
+                self._unwritten[name] = idx
+            if name in self._unwritten:
+                self._pending.setdefault(threading.get_ident(), {})[name] = idx
+            return idx
+
+    def flush(self, cursor):
+        """
+        Insert new rows interned by current thread, without commit
+        :param cursor: of connection of current thread
+        :return: None
+        """
+        with self._lock:
+            pending = self._pending.pop(threading.get_ident(), None)
+        if pending:
+            # not under lock: other thread may hold write lock of DB and wait for intern
+            cursor.executemany(self.sql[2], [(idx, name) for name, idx in pending.items()])
+            with self._lock:
+                for name in pending:
+                    self._unwritten.pop(name, None)
+
+    def invalidate(self):
+        """
+        Reload on next use, after rows were deleted or renamed.
+        Pending rows are kept
+        :return: None
+        """
+        with self._lock:
+            self._ids = None
+
+    def _load(self):
+        if self._ids is None:
+            curs = self.conn.cursor()
+            self._ids = dict(curs.execute(self.sql[0]).fetchall())
+            self._last_id = max(curs.execute(self.sql[1]).fetchone()[0],
+                                self._last_id)
+            self._ids.update(self._unwritten)
+
+
+class PathCache:
+    """
+    DirID -> (Path, PlaceId) of Dirs, filled on demand, paths of many
+    dirs are read by one query. Holds dirs of one place: it is cleared
+    when other place is chosen, and when dirs are renamed, moved or deleted
+    """
+    def __init__(self, connection):
+        self.conn = connection
+        self.place_id = None
+        self._paths = {}
+        self._lock = threading.Lock()
+
+    def get(self, dir_id):
+        """
+        :param dir_id:
+        :return: (Path, PlaceId) or None if there is no such dir
+        """
+        return self.get_many((dir_id,)).get(dir_id)
+
+    def get_many(self, dir_ids):
+        """
+        :param dir_ids: iterable of DirIDs
+        :return: dict DirID -> (Path, PlaceId), unknown dirs are missing
+        """
+        dir_ids = set(dir_ids)
+        with self._lock:
+            missing = [dir_id for dir_id in dir_ids if dir_id not in self._paths]
+            if missing:
+                rows = self.conn.cursor().execute(DIR_PATHS, (json.dumps(missing),))
+                for dir_id, path, place_id in rows:
+                    self._paths[dir_id] = (path, place_id)
+            paths = self._paths
+            return {dir_id: paths[dir_id] for dir_id in dir_ids if dir_id in paths}
+
+    def set_place(self, place_id):
+        """
+        :param place_id: current place, dirs of previous place are dropped
+        :return: None
+        """
+        with self._lock:
+            if place_id != self.place_id:
+                self.place_id = place_id
+                self._paths.clear()
+
+    def invalidate(self):
+        """
+        Reload on next use, after dirs were renamed, moved or deleted
+        :return: None
+        """
+        with self._lock:
+            self._paths.clear()
+
+
+class DetailCache:
+    """
+    LRU of FileID -> file_details shown in comment field: tags, authors,
+    comment and book title. Details of files around current row are
+    read in advance by prefetch, so moving through file list needs no
+    queries. Details of file are dropped when they are edited,
+    all - when a worker changed files
+    """
+    def __init__(self, connection, size=DETAIL_SIZE):
+        self.conn = connection
+        self.size = size
+        self._details = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, file_id):
+        return file_id in self._details
+
+    def get(self, file_id):
+        """
+        :param file_id:
+        :return: file_details
+        """
+        with self._lock:
+            if file_id not in self._details:
+                self._load([file_id])
+            self._details.move_to_end(file_id)
+            return self._details[file_id]
+
+    def prefetch(self, file_ids):
+        """
+        Read details of files not in cache, by one query for each table
+        :param file_ids: iterable of FileIDs, no more than size of cache
+        :return: None
+        """
+        with self._lock:
+            missing = [file_id for file_id in set(file_ids) if file_id not in self._details]
+            if missing:
+                self._load(missing)
+
+    def invalidate(self, file_id=None):
+        """
+        :param file_id: None - drop details of all files
+        :return: None
+        """
+        with self._lock:
+            if file_id is None:
+                self._details.clear()
+            else:
+                self._details.pop(file_id, None)
+
+    def _load(self, file_ids):
+        ids = json.dumps(file_ids)
+        curs = self.conn.cursor()
+        tags = {file_id: [] for file_id in file_ids}
+        authors = {file_id: [] for file_id in file_ids}
+        comments = {}
+        for file_id, tag in curs.execute(FILE_DETAILS['tags'], (ids,)):
+            tags[file_id].append(tag)
+        for file_id, author in curs.execute(FILE_DETAILS['authors'], (ids,)):
+            authors[file_id].append(author)
+        for file_id, comment, title in curs.execute(FILE_DETAILS['comments'], (ids,)):
+            comments[file_id] = (comment, title)
+        for file_id in file_ids:
+            self._details[file_id] = file_details(tags[file_id], authors[file_id],
+                                                  *comments.get(file_id, ('', '')))
+        while len(self._details) > self.size:
+            self._details.popitem(last=False)
@@ -0,0 +1,621 @@
+# model/pdf_info.py
+# functions run in worker processes - no Qt imports here
+
+import datetime
+import mmap
+import os
+import re
+import stat
+import zlib
+
+from PyPDF2 import PdfFileReader, utils
+
+NO_DATE = '0001-01-01'
+
+TAIL_SIZE = 4096            # 'startxref' is searched in the last bytes of file
+VALUE_SIZE = 4096           # initial size of chunk read for one object
+MAX_VALUE_SIZE = 1 << 20    # objects bigger than this are left to PyPDF2
+
+
+def get_file_info(full_file_name):
+    """
+    :param full_file_name:
+    :return: list [size, date] for any file, for pdf file extended with
+             [pages, author, issue date, title]
+    """
+    file_info = get_stat_info(full_file_name)
+    if file_info[0] != '' and is_pdf(full_file_name):
+        file_info += get_pdf_info(full_file_name)
+    return file_info
+
+
+def get_stat_info(full_file_name):
+    """
+    Size and modification date only, the file is not opened
+    :param full_file_name:
+    :return: list [size, date], ['', ''] if there is no such file
+    """
+    try:
+        st = os.stat(full_file_name)
+    except OSError:
+        return ['', '']
+    if not stat.S_ISREG(st.st_mode):
+        return ['', '']
+    return [st.st_size, datetime.datetime.fromtimestamp(st.st_mtime).date().isoformat()]
+
+
+def is_pdf(file_name):
+    return file_name.lower().endswith('.pdf')
+
+
+def get_pdf_info(file_):
+    """
+    Fast reader first, PyPDF2 if fast reader can't handle the file
+    :param file_: full name of pdf file
+    :return: [pages, author, issue date, title]
+    """
+    try:
+        return fast_pdf_info(file_)
+    except (FastPdfError, OSError) as e:
+        print('--> get_pdf_info, fallback to PyPDF2:', e)
+        return pypdf_info(file_)
+
+
+def pypdf_info(file_):
+    """
+    :param file_: full name of pdf file
+    :return: [pages, author, issue date, title]
+    """
+    with (open(file_, "rb")) as pdf_file:
+        try:
+            fr = PdfFileReader(pdf_file, strict=False)
+            fi = fr.documentInfo
+            pages = fr.getNumPages()
+        except (ValueError, utils.PdfReadError, utils.PdfStreamError) as e:
+            print('--> get_pdf_info, EXCEPTION', e)
+            return [0, '', '', '']
+        else:
+            if fi is not None:
+                return [pages, fi.getText('/Author'),
+                        pdf_creation_date(fi.getText('/CreationDate')),
+                        fi.getText('/Title')]
+            return [pages, '', '', '']
+
+
+def pdf_creation_date(ww):
+    """
+    :param ww: pdf date string like "D:20180131..."
+    :return: date in ISO format
+    """
+    if ww:
+        tt = '-'.join((ww[2:6], ww[6:8], ww[8:10]))
+        try:
+            datetime.datetime.strptime(tt, '%Y-%m-%d')
+        except ValueError:
+            tt = NO_DATE
+        return tt
+    return NO_DATE
+
+
+class FastPdfError(Exception):
+    pass
+
+
+def fast_pdf_info(file_):
+    """
+    Read only what is needed: trailer, Info dictionary, catalog and
+    root of page tree. The file is mapped into memory, so untouched
+    parts (page contents, images) are never read from disk.
+    Classic xref tables, xref streams and object streams are supported,
+    encrypted files and other stream filters raise FastPdfError
+    :param file_: full name of pdf file
+    :return: [pages, author, issue date, title]
+    """
+    with open(file_, "rb") as pdf_file:
+        try:
+            with mmap.mmap(pdf_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return _FastPdf(mm).info()
+        except (IndexError, KeyError, ValueError, OverflowError, zlib.error) as e:
+            raise FastPdfError('{}: {!r}'.format(file_, e)) from e
+
+
+_WHITE = b' \t\r\n\f\x00'
+_DELIM = _WHITE + b'()<>[]{}/%'
+_ESCAPES = {ord('n'): 10, ord('r'): 13, ord('t'): 9, ord('b'): 8, ord('f'): 12}
+
+_OBJ_HEADER = re.compile(rb'\s*(\d+)\s+(\d+)\s+obj')
+_SUBSECTION = re.compile(rb'\s*(\d+)[ \t]+(\d+)[ \t]*\r?\n')
+_XREF_ENTRY = re.compile(rb'(\d{10}) (\d{5}) ([nf])')
+_REF = re.compile(rb'(\d+)\s+(\d+)\s+R$')
+_REF_TAIL = re.compile(rb'\s+\d+\s+R(?![^ \t\r\n\f\x00()<>\[\]{}/%])')
+_STREAM = re.compile(rb'\s*stream\r?\n')
+
+
+class _FastPdf:
+    def __init__(self, mm):
+        self.mm = mm
+        self.trailers = []      # latest first
+        self.xrefs = []         # latest first: list of subsections or dict
+        self.obj_streams = {}   # object number -> (data, {number: offset})
+
+    def info(self):
+        self._load_xrefs()
+        if self._trailer_value(b'/Encrypt'):
+            raise FastPdfError('encrypted')
+
+        root_ref = self._trailer_value(b'/Root')
+        if root_ref is None:
+            raise FastPdfError('no /Root')
+        root = _parse_dict(self._object(root_ref))
+        pages = _parse_dict(self._resolve(root[b'/Pages']))
+        count = int(self._resolve(pages[b'/Count']))
+
+        info_ref = self._trailer_value(b'/Info')
+        if not info_ref:
+            return [count, '', '', '']
+        info = _parse_dict(self._object(info_ref))
+        return [count, self._text(info, b'/Author'),
+                pdf_creation_date(self._text(info, b'/CreationDate')),
+                self._text(info, b'/Title')]
+
+    def _trailer_value(self, key):
+        for trailer in self.trailers:
+            if key in trailer:
+                return trailer[key]
+        return None
+
+    def _load_xrefs(self):
+        mm = self.mm
+        pos = mm.rfind(b'startxref', max(0, len(mm) - TAIL_SIZE))
+        if pos < 0:
+            raise FastPdfError('startxref not found')
+        offset = int(_value_at(mm[pos + 9:pos + 40], 0)[0])
+
+        seen = set()
+        while offset is not None and offset not in seen:
+            seen.add(offset)
+            if mm[offset:offset + 4] == b'xref':
+                self.xrefs.append(self._xref_table(offset + 4))
+                pos = mm.find(b'trailer', offset)
+                if pos < 0:
+                    raise FastPdfError('trailer not found')
+                trailer = _parse_dict(self._read_value(pos + 7)[0])
+                if b'/XRefStm' in trailer:      # hybrid file
+                    self.xrefs.append(self._xref_stream(int(trailer[b'/XRefStm']))[1])
+            else:
+                trailer, entries = self._xref_stream(offset)
+                self.xrefs.append(entries)
+            self.trailers.append(trailer)
+            offset = int(trailer[b'/Prev']) if b'/Prev' in trailer else None
+
+    def _xref_table(self, pos):
+        """
+        Only headers of subsections are parsed, entries have fixed size
+        :param pos: position after 'xref' keyword
+        :return: list of (first number, count, position of first entry)
+        """
+        sections = []
+        while True:
+            match = _SUBSECTION.match(self.mm, pos)
+            if match is None:       # 'trailer' reached
+                return sections
+            first, count = int(match.group(1)), int(match.group(2))
+            sections.append((first, count, match.end()))
+            pos = match.end() + 20 * count
+
+    def _xref_stream(self, offset):
+        """
+        :param offset: offset of xref stream object
+        :return: stream dictionary, {number: (type, field2, field3)}
+        """
+        dict_, data = self._stream(offset)
+        widths = [int(x) for x in _array(dict_[b'/W'])]
+        index = ([int(x) for x in _array(dict_[b'/Index'])]
+                 if b'/Index' in dict_ else [0, int(dict_[b'/Size'])])
+        row = sum(widths)
+        entries = {}
+        pos = 0
+        for first, count in zip(index[::2], index[1::2]):
+            if pos + row * count > len(data):
+                raise FastPdfError('short xref stream')
+            for num in range(first, first + count):
+                fields = []
+                for width in widths:
+                    fields.append(int.from_bytes(data[pos:pos + width], 'big'))
+                    pos += width
+                if widths[0] == 0:
+                    fields[0] = 1
+                entries[num] = tuple(fields)
+        return dict_, entries
+
+    def _entry(self, num):
+        """
+        :param num: object number
+        :return: (1, offset, gen) or (2, object stream number, index)
+        """
+        for xref in self.xrefs:
+            if isinstance(xref, dict):
+                if num in xref:
+                    return xref[num]
+                continue
+            for first, count, pos in xref:
+                if first <= num < first + count:
+                    pos += 20 * (num - first)
+                    match = _XREF_ENTRY.match(self.mm, pos)
+                    if match is None:
+                        raise FastPdfError('bad xref entry of {}'.format(num))
+                    if match.group(3) == b'f':
+                        return (0, 0, 0)
+                    return (1, int(match.group(1)), int(match.group(2)))
+        raise FastPdfError('object {} not in xref'.format(num))
+
+    def _object(self, ref):
+        """
+        :param ref: reference like b'12 0 R'
+        :return: value of object as bytes
+        """
+        match = _REF.match(ref) if isinstance(ref, bytes) else None
+        if match is None:
+            raise FastPdfError('not a reference: {!r}'.format(ref))
+        num = int(match.group(1))
+        kind, field2, field3 = self._entry(num)
+        if kind == 1:
+            return self._read_value(self._obj_body(field2, num))[0]
+        if kind == 2:
+            data, offsets = self._obj_stream(field2)
+            return _value_at(data, offsets[num])[0]
+        raise FastPdfError('object {} is free'.format(num))
+
+    def _resolve(self, value):
+        return self._object(value) if isinstance(value, bytes) and _REF.match(value) else value
+
+    def _obj_body(self, offset, num=None):
+        match = _OBJ_HEADER.match(self.mm, offset)
+        if match is None or (num is not None and int(match.group(1)) != num):
+            raise FastPdfError('no object {} at {}'.format(num, offset))
+        return match.end()
+
+    def _obj_stream(self, num):
+        if num not in self.obj_streams:
+            kind, offset, _ = self._entry(num)
+            if kind != 1:
+                raise FastPdfError('bad object stream {}'.format(num))
+            dict_, data = self._stream(offset)
+            first = int(dict_[b'/First'])
+            header = data[:first].split()
+            offsets = {int(n): first + int(off)
+                       for n, off in zip(header[::2], header[1::2])}
+            self.obj_streams[num] = (data, offsets)
+        return self.obj_streams[num]
+
+    def _stream(self, offset):
+        """
+        :param offset: offset of stream object
+        :return: stream dictionary, decoded data
+        """
+        value, pos = self._read_value(self._obj_body(offset))
+        dict_ = _parse_dict(value)
+        match = _STREAM.match(self.mm, pos)
+        if match is None:
+            raise FastPdfError('no stream at {}'.format(offset))
+        length = int(self._resolve(dict_[b'/Length']))
+        data = self.mm[match.end():match.end() + length]
+
+        filters = _array(dict_.get(b'/Filter', b'[]'))
+        if filters == [b'/FlateDecode']:
+            data = zlib.decompress(data)
+        elif filters:
+            raise FastPdfError('unsupported filter {!r}'.format(filters))
+        if b'/DecodeParms' in dict_:
+            parms = _parse_dict(self._resolve(dict_[b'/DecodeParms']))
+            predictor = int(parms.get(b'/Predictor', 1))
+            if predictor >= 10:
+                data = _png_decode(data, int(parms.get(b'/Columns', 1)))
+            elif predictor != 1:
+                raise FastPdfError('unsupported predictor {}'.format(predictor))
+        return dict_, data
+
+    def _read_value(self, pos):
+        """
+        Read value starting at pos, the chunk grows if the value
+        does not fit
+        :param pos: absolute position in file
+        :return: value as bytes, absolute position after value
+        """
+        size = VALUE_SIZE
+        while True:
+            chunk = self.mm[pos:pos + size]
+            try:
+                value, end = _value_at(chunk, 0)
+                return value, pos + end
+            except (IndexError, ValueError, FastPdfError):
+                if pos + size >= len(self.mm) or size >= MAX_VALUE_SIZE:
+                    raise
+                size *= 16
+
+    def _text(self, dict_, key):
+        if key not in dict_:
+            return ''
+        return _decode_text(self._resolve(dict_[key]))
+
+
+def _skip_white(data, i):
+    size = len(data)
+    while True:
+        while i < size and data[i] in _WHITE:
+            i += 1
+        if i < size and data[i] == 0x25:            # '%' comment
+            while i < size and data[i] not in b'\r\n':
+                i += 1
+        else:
+            return i
+
+
+def _value_at(data, i):
+    """
+    :param data:
+    :param i: position of value or of white space before it
+    :return: value as bytes, position after value
+    """
+    i = _skip_white(data, i)
+    end = _value_end(data, i)
+    return data[i:end], end
+
+
+def _value_end(data, i):
+    char = data[i]
+    if char == 0x28:                                # '(' literal string
+        return _literal(data, i)[1]
+    if char == 0x3c:                                # '<'
+        if data[i + 1] == 0x3c:                     # '<<' dictionary
+            i = _skip_white(data, i + 2)
+            while data[i:i + 2] != b'>>':
+                i = _skip_white(data, _value_end(data, i))
+                if i >= len(data):
+                    raise IndexError('unterminated dictionary')
+            return i + 2
+        return data.index(b'>', i) + 1              # hex string
+    if char == 0x5b:                                # '[' array
+        end = data.index(b']', i)
+        part = data[i + 1:end]
+        if b'(' not in part and b'<' not in part and b'[' not in part and b'%' not in part:
+            return end + 1                          # flat array like /Kids
+        i = _skip_white(data, i + 1)
+        while data[i] != 0x5d:
+            i = _skip_white(data, _value_end(data, i))
+        return i + 1
+    end = i + 1                                     # name, number, keyword
+    while end < len(data) and data[end] not in _DELIM:
+        end += 1
+    if char != 0x2f and end == i + 1 and char in _DELIM:
+        raise FastPdfError('unexpected {!r}'.format(chr(char)))
+    if 0x30 <= char <= 0x39:
+        match = _REF_TAIL.match(data, end)
+        if match:
+            return match.end()
+    return end
+
+
+def _parse_dict(value):
+    """
+    :param value: dictionary as bytes
+    :return: dict {key: value as bytes}, only top level is parsed
+    """
+    if value[:2] != b'<<':
+        raise FastPdfError('not a dictionary: {!r}'.format(value[:20]))
+    res = {}
+    i = _skip_white(value, 2)
+    while value[i:i + 2] != b'>>':
+        key_end = _value_end(value, i)
+        res[value[i:key_end]], i = _value_at(value, key_end)
+        i = _skip_white(value, i)
+    return res
+
+
+def _array(value):
+    """
+    :param value: array or single value as bytes
+    :return: list of items as bytes
+    """
+    if value[:1] != b'[':
+        return [value]
+    items = []
+    i = _skip_white(value, 1)
+    while value[i] != 0x5d:
+        end = _value_end(value, i)
+        items.append(value[i:end])
+        i = _skip_white(value, end)
+    return items
+
+
+def _literal(data, i):
+    """
+    :param data:
+    :param i: position of '('
+    :return: string with resolved escapes, position after ')'
+    """
+    out = bytearray()
+    depth = 1
+    i += 1
+    while True:
+        char = data[i]
+        i += 1
+        if char == 0x5c:                            # backslash
+            char = data[i]
+            i += 1
+            if char in _ESCAPES:
+                out.append(_ESCAPES[char])
+            elif 0x30 <= char <= 0x37:              # octal, up to 3 digits
+                code = char - 0x30
+                for _ in range(2):
+                    if 0x30 <= data[i] <= 0x37:
+                        code = code * 8 + data[i] - 0x30
+                        i += 1
+                    else:
+                        break
+                out.append(code & 0xff)
+            elif char == 0x0d:                      # line continuation
+                if data[i] == 0x0a:
+                    i += 1
+            elif char != 0x0a:
+                out.append(char)
+            continue
+        if char == 0x28:
+            depth += 1
+        elif char == 0x29:
+            depth -= 1
+            if depth == 0:
+                return bytes(out), i
+        out.append(char)
+
+
+def _decode_text(value):
+    """
+    :param value: literal or hex string as bytes
+    :return: str
+    """
+    if value[:1] == b'(':
+        raw = _literal(value, 0)[0]
+    elif value[:1] == b'<':
+        digits = bytes(value[1:-1]).translate(None, _WHITE)
+        raw = bytes.fromhex((digits + b'0' * (len(digits) % 2)).decode())
+    else:
+        return ''
+    if raw[:2] == b'\xfe\xff':
+        return raw[2:].decode('utf-16-be', errors='replace')
+    if raw[:3] == b'\xef\xbb\xbf':
+        return raw[3:].decode('utf-8', errors='replace')
+    return raw.decode('latin-1')
+
+
+def _png_decode(data, columns):
+    """
+    Undo PNG predictors (None, Sub, Up), used by xref streams
+    """
+    row_len = columns + 1
+    prev = bytes(columns)
+    out = bytearray()
+    for pos in range(0, len(data) - columns, row_len):
+        kind = data[pos]
+        row = bytearray(data[pos + 1:pos + row_len])
+        if kind == 1:
+            for j in range(1, columns):
+                row[j] = (row[j] + row[j - 1]) & 0xff
+        elif kind == 2:
+            row = bytearray((a + b) & 0xff for a, b in zip(row, prev))
+        elif kind != 0:
+            raise FastPdfError('unsupported PNG predictor {}'.format(kind))
+        out += row
+        prev = row
+    return bytes(out)
+
+
+def _make_pdf(file_, pages, image_size, compressed):
+    """
+    Generate pdf for benchmark: flat page tree, each page has
+    an image of image_size bytes.
+    compressed=False - classic xref table, all objects in file body
+    compressed=True - catalog, page tree and Info in object stream,
+                      xref stream with PNG predictor
+    """
+    kids = []
+    body = []
+    num = 3
+    for _ in range(pages):
+        page, image, num = num + 1, num + 2, num + 2
+        kids.append(page)
+        body.append((page, ' '.join(('<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792]',
+                                     '/Resources << /XObject << /Im0 {} 0 R >> >> >>'
+                                     )).format(image).encode()))
+        body.append((image, b''.join((b'<< /Type /XObject /Subtype /Image /Width 1 /Height 1 ',
+                                      b'/BitsPerComponent 8 /ColorSpace /DeviceGray ',
+                                      b'/Length %d >>\nstream\n' % image_size,
+                                      bytes(image_size), b'\nendstream'))))
+    head = [(1, b'<< /Type /Catalog /Pages 2 0 R >>'),
+            (2, '<< /Type /Pages /Kids [{}] /Count {} >>'.format(
+                ' '.join('{} 0 R'.format(x) for x in kids), pages).encode()),
+            (3, b''.join((b'<< /Author (Jane Doe \\(ed.\\)) ',
+                          b'/Title <FEFF00540069 0074006C0065> ',
+                          b'/CreationDate (D:20190315120000Z) >>')))]
+
+    out = bytearray(b'%PDF-1.5\n%\xe2\xe3\xcf\xd3\n')
+    offsets = {}
+
+    def add(number, content):
+        offsets[number] = len(out)
+        out.extend(b'%d 0 obj\n' % number + content + b'\nendobj\n')
+
+    for number, content in body:
+        add(number, content)
+    if compressed:
+        objects, header = b'', []
+        for number, content in head:
+            header.append(b'%d %d' % (number, len(objects)))
+            objects += content + b'\n'
+        header = b' '.join(header) + b'\n'
+        data = zlib.compress(header + objects)
+        add(num + 1, b'<< /Type /ObjStm /N %d /First %d /Filter /FlateDecode /Length %d >>\n'
+            % (len(head), len(header), len(data)) + b'stream\n' + data + b'\nendstream')
+
+        size = num + 3
+        offsets[num + 2] = len(out)
+        rows, prev = bytearray(), bytes(7)
+        for number in range(size):
+            if number == 0:
+                row = (0).to_bytes(5, 'big') + (65535).to_bytes(2, 'big')
+            elif number <= len(head):
+                row = b'\x02' + (num + 1).to_bytes(4, 'big') + (number - 1).to_bytes(2, 'big')
+            else:
+                row = b'\x01' + offsets[number].to_bytes(4, 'big') + bytes(2)
+            rows += b'\x02' + bytes((a - b) & 0xff for a, b in zip(row, prev))
+            prev = row
+        data = zlib.compress(bytes(rows))
+        xref = len(out)
+        add(num + 2, b''.join((b'<< /Type /XRef /Size %d /W [1 4 2] /Root 1 0 R /Info 3 0 R ' % size,
+                               b'/Filter /FlateDecode /DecodeParms << /Columns 7 /Predictor 12 >> ',
+                               b'/Length %d >>\nstream\n' % len(data), data, b'\nendstream')))
+    else:
+        for number, content in head:
+            add(number, content)
+        xref = len(out)
+        out += b'xref\n0 %d\n0000000000 65535 f \n' % (num + 1)
+        for number in range(1, num + 1):
+            out += b'%010d 00000 n \n' % offsets[number]
+        out += b'trailer\n<< /Size %d /Root 1 0 R /Info 3 0 R >>\n' % (num + 1)
+    out += b'startxref\n%d\n%%%%EOF\n' % xref
+    with open(file_, 'wb') as pdf_file:
+        pdf_file.write(out)
+
+
+if __name__ == "__main__":
+    # benchmark: fast reader vs PyPDF2 on generated corpus
+    import sys
+    import tempfile
+    import time
+
+    scale = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    corpus = (('small', 40, 2, 20000),          # group, files, pages, image bytes
+              ('large', 3, 1000 * scale, 50000))
+    with tempfile.TemporaryDirectory() as tmp:
+        for group, files, pages, image_size in corpus:
+            for compressed in (False, True):
+                names = []
+                for i in range(files):
+                    name = os.path.join(tmp, '{}_{}_{}.pdf'.format(group, compressed, i))
+                    _make_pdf(name, pages, image_size, compressed)
+                    names.append(name)
+                size = sum(os.path.getsize(x) for x in names) / 2 ** 20
+
+                times, results = [], []
+                for reader in (fast_pdf_info, pypdf_info):
+                    start = time.perf_counter()
+                    results.append([reader(x) for x in names])
+                    times.append(time.perf_counter() - start)
+                print('{} {} files, {} pages, {:.1f} MB, {}: fast {:.3f} s, PyPDF2 {:.3f} s,'
+                      ' x{:.0f}, same result: {}'.format(
+                          files, group, pages, size,
+                          'xref stream' if compressed else 'xref table',
+                          times[0], times[1], times[1] / max(times[0], 1e-9),
+                          results[0] == results[1]))
+                for name in names:
+                    os.remove(name)
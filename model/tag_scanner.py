@@ -0,0 +1,226 @@
+# model/tag_scanner.py
+
+import re
+
+from PyQt5.QtCore import pyqtSignal, QObject, pyqtSlot
+
+from model.helper import Shared
+
+READ_BATCH = 2000       # number of files read from DB in one query
+WRITE_BATCH = 5000      # number of FileTag rows inserted by one executemany
+
+COUNT_FILES = 'select count(*) from Files where ExtID in (select value from json_each(:exts));'
+
+# text to search tags in: file name, book title and comment
+FILES_TEXT = ' '.join(('select f.FileID, f.FileName, c.BookTitle, c.Comment from Files f',
+                       'left join Comments c on c.CommentID = f.CommentID',
+                       'where f.ExtID in (select value from json_each(:exts))',
+                       'and f.FileID > :file order by f.FileID limit :limit;'))
+
+INSERT_FILE_TAG = 'insert or ignore into FileTag (TagID, FileID) values (?, ?);'
+
+WORD_CHAR = re.compile(r'\w')
+
+
+def trie_pattern(words):
+    """
+    Regular expression matching any of words, built as a trie:
+    (?:ab(?:c|d)?|x) for 'ab', 'abc', 'abd', 'x', so its cost does not
+    grow with the number of words as in plain alternation. Longer
+    word is tried first
+    :param words: not empty strings
+    :return: pattern
+    """
+    return _trie_node(make_trie(words))
+
+
+def make_trie(words):
+    """
+    :param words: not empty strings
+    :return: nested dicts char -> node, key '' marks end of word
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    return trie
+
+
+def _trie_node(node):
+    alts = [re.escape(char) + _trie_node(sub) for char, sub in sorted(node.items()) if char]
+    if not alts:
+        return ''
+    pattern = alts[0] if len(alts) == 1 else '(?:{})'.format('|'.join(alts))
+    if '' in node:
+        return '(?:{})?'.format(pattern)
+    return pattern
+
+
+class TagMatcher:
+    """
+    All tags in one regular expression: whole words, case insensitive.
+    Search is restarted after start of each match, so overlapping tags
+    are found; regex gives only the longest tag at each start, shorter
+    ones inside it ('data' in 'data science', 'c' in 'c++') are added
+    from the table of nested tags
+    """
+    def __init__(self, tags):
+        """
+        :param tags: iterable of (tag, TagID)
+        """
+        self.ids = {}
+        for tag, tag_id in tags:
+            if tag.strip():
+                self.ids.setdefault(tag.lower(), set()).add(tag_id)
+        trie = make_trie(self.ids)
+        self.regex = (re.compile(r'(?<!\w){}(?!\w)'.format(_trie_node(trie)),
+                                 re.IGNORECASE) if self.ids else None)
+        self.nested = {word: self._find(trie, word) for word in self.ids}
+
+    def match(self, text):
+        """
+        :param text:
+        :return: set of TagIDs of tags found in text
+        """
+        found = set()
+        if self.regex is not None and text:
+            for word in self._words(text):
+                found |= self.nested.get(word) or self.ids.get(word, set())
+        return found
+
+    def _find(self, trie, word):
+        """
+        :param trie: of all tags
+        :param word: tag
+        :return: set of TagIDs of tags that are whole words in word,
+                 including the word itself
+        """
+        res = set()
+        for start in range(len(word)):
+            if start and WORD_CHAR.match(word[start - 1]):
+                continue
+            node = trie
+            for end in range(start, len(word) + 1):
+                if '' in node and (end == len(word) or not WORD_CHAR.match(word[end])):
+                    res |= self.ids[word[start:end]]
+                if end == len(word) or word[end] not in node:
+                    break
+                node = node[word[end]]
+        return res
+
+    def _words(self, text):
+        pos = 0
+        search = self.regex.search
+        while True:
+            m = search(text, pos)
+            if m is None:
+                return
+            yield m.group().lower()
+            pos = m.start() + 1
+
+
+class TagScanner(QObject):
+    """
+    Link tags to files which have a tag as a whole word in file name,
+    book title or comment. Files of selected extensions are read once
+    by pages from read connection, found links are inserted by batches
+    in one transaction of own write connection
+    """
+    finished = pyqtSignal()
+    progress = pyqtSignal(int, int)     # number of scanned files, number of files
+
+    def __init__(self, tags, ext_ids):
+        """
+        :param tags: iterable of (tag, TagID)
+        :param ext_ids: ExtIDs of files to scan
+        """
+        super().__init__()
+        print('--> TagScanner.__init__')
+        self.matcher = TagMatcher(tags)
+        self.ext_ids = Shared['DB utility'].id_list(ext_ids)
+        self.conn = Shared['DB utility'].open_writer() or Shared['DB connection']
+        self.added = 0
+
+    @pyqtSlot()
+    def run(self):
+        print('--> TagScanner.run')
+        dbu = Shared['DB utility']
+        try:
+            self.scan()
+            dbu.sync_fts(self.conn)
+        finally:
+            dbu.close_connection(self.conn)
+        self.finished.emit()
+
+    def scan(self):
+        """
+        :return: number of added links file - tag
+        """
+        cursor = self.conn.cursor()
+        total = cursor.execute(COUNT_FILES, {'exts': self.ext_ids}).fetchone()[0]
+        scanned = 0
+        rows = []
+        for file_id, *text in self._files():
+            for tag_id in self.matcher.match(' '.join(filter(None, text))):
+                rows.append((tag_id, file_id))
+            scanned += 1
+            if len(rows) >= WRITE_BATCH:
+                self._insert(cursor, rows)
+            if scanned % READ_BATCH == 0:
+                self.progress.emit(scanned, total)
+        self._insert(cursor, rows)
+        self.conn.commit()
+        self.progress.emit(scanned, total)
+        return self.added
+
+    def get_added(self):
+        return self.added
+
+    def _insert(self, cursor, rows):
+        if rows:
+            cursor.executemany(INSERT_FILE_TAG, rows)
+            self.added += cursor.rowcount    # ignored rows, already linked, are not counted
+            rows.clear()
+
+    def _files(self):
+        """
+        Files to scan, read by pages from separate read connection
+        :return: generator of (FileID, FileName, BookTitle, Comment)
+        """
+        dbu = Shared['DB utility']
+        reader = dbu.open_reader() or self.conn
+        try:
+            key = {'exts': self.ext_ids, 'file': -1, 'limit': READ_BATCH}
+            while True:
+                rows = reader.execute(FILES_TEXT, key).fetchall()
+                yield from rows
+                if len(rows) < READ_BATCH:
+                    break
+                key['file'] = rows[-1][0]
+        finally:
+            if reader is not self.conn:
+                dbu.close_connection(reader)
+
+
+if __name__ == "__main__":
+    # check: the same links as search of each tag as whole word
+    # python -m model.tag_scanner
+    def _each_tag(tags, text):
+        return {tag_id for tag, tag_id in tags
+                if re.search(r'(?<!\w){}(?!\w)'.format(re.escape(tag)), text, re.IGNORECASE)}
+
+    cases = [((('data', 1), ('data science', 2), ('science fiction', 3), ('science', 4)),
+              ('Data Science Fiction book', 'data', 'science fiction', 'no tags here')),
+             ((('c', 1), ('c++', 2), ('c#', 3), ('learn', 4), ('learn c', 5)),
+              ('learn c++ now', 'C# and C', 'learn c', 'abc++')),
+             ((('a b c', 1), ('a b', 2), ('b c', 3), ('b', 4), ('a', 5)),
+              ('a b c', 'x a b c d', 'ab c', 'b'))]
+    for tags, texts in cases:
+        matcher = TagMatcher(tags)
+        for text in texts:
+            found, expected = matcher.match(text), _each_tag(tags, text)
+            print('{!r}: {} {}'.format(text, sorted(found), 'ok' if found == expected
+                                       else 'expected {}'.format(sorted(expected))))
+            assert found == expected
@@ -2,40 +2,53 @@
 
 import sqlite3
 import datetime
+import json
+import re
+import threading
+from collections import OrderedDict
 from model.helper import EXT_ID_INCREMENT, Shared
+from model import create_db
+from model.lookup_cache import LookupCache, PathCache, DetailCache
+
+
+Selects = {'TREE':  # (Dir name, DirID, ParentID, isVirtual, level)
+               ' '.join(('select d.Path, d.DirID, d.ParentID, d.isVirtual, t.Depth - :top as level',
+                         'from DirTree t, Dirs d where t.Ancestor = :dir_id',
+                         'and d.DirID = t.Descendant and d.PlaceId = :place_id',
+                         'and t.Depth >= :top and (:level = 0 or t.Depth - :top <= :level)',
+                         'order by level desc, d.Path;')),
+
+           # subdirectories with flag "has subdirectories", for lazy dirTree
+           'DIR_CHILDREN': ' '.join((
+               'select d.Path, d.DirID, d.ParentID, d.isVirtual, exists (select 1 from Dirs c',
+               'where c.ParentID = d.DirID) or exists (select 1 from VirtDirs c',
+               'where c.ParentID = d.DirID) from Dirs d',
+               'where d.ParentID = :dir_id and d.PlaceId = :place_id order by d.Path;')),
+           # new and moved dirs, flag: has subdirectories other than new and moved
+           'DIRS_BY_IDS': ' '.join((
+               'select d.Path, d.DirID, d.ParentID, d.isVirtual, exists (select 1 from Dirs c',
+               'where c.ParentID = d.DirID and c.DirID not in (select value from json_each(:ids)))',
+               'or exists (select 1 from VirtDirs c where c.ParentID = d.DirID) from Dirs d',
+               'where d.DirID in (select value from json_each(:ids)) order by d.Path;')),
+           # virtual copies in dir, copy of Favorites is a virtual folder
+           'VIRT_DIR_CHILDREN': ' '.join((
+               'select d.Path, d.DirID, v.ParentID, case d.isVirtual when 1 then 2',
+               'else d.isVirtual end, exists (select 1 from Dirs c',
+               'where c.ParentID = d.DirID) or exists (select 1 from VirtDirs c',
+               'where c.ParentID = d.DirID) from VirtDirs v, Dirs d',
+               'where v.ParentID = :dir_id and v.PlaceID = :place_id and d.DirID = v.DirID',
+               'order by d.Path;')),
 
-
-Selects = {'TREE':  # (Dir name, DirID, ParentID, Full path of dir)
-               (' '.join(('WITH x(Path, DirID, ParentID, isVirtual, level) AS',
-                          '(SELECT Path, DirID, ParentID, isVirtual, 0 as level',)),
-                'FROM Dirs WHERE DirID = {} and PlaceId = {}',
-                'FROM Dirs WHERE ParentID = {} and PlaceId = {}',
-                ' '.join(('UNION ALL SELECT t.Path, t.DirID, t.ParentID, t.isVirtual,',
-                          'x.level + 1 as lvl FROM x INNER JOIN Dirs AS t',
-                          'ON t.ParentID = x.DirID')),
-                'and lvl <= {}) SELECT * FROM x order by level desc, Path;',
-                ') SELECT * FROM x order by level desc, Path;',
-                ),
-
-           'VIRT_DIRS': ' '.join(('select d.Path, d.DirID, v.ParentID, d.isVirtual from Dirs d', 
-                                  'inner join VirtDirs v on d.DirID = v.DirID where v.PlaceID = ?;')),
            'DIR_IDS':
-               ('WITH x(DirID, ParentID, isVirtual, level) AS (SELECT DirID, ParentID, isVirtual, 0 as level',
-                'FROM Dirs WHERE DirID = {} and PlaceId = {}',
-                'FROM Dirs WHERE ParentID = {} and PlaceId = {}',
-                ' '.join(('UNION ALL SELECT t.DirID, t.ParentID, t.isVirtual,',
-                          'x.level + 1 as lvl FROM x INNER JOIN Dirs AS t',
-                          'ON t.ParentID = x.DirID')),
-                'and lvl <= {}) SELECT DirID FROM x order by DirID;',
-                ') SELECT DirID FROM x order by DirID;'),
+               ' '.join(('select t.Descendant from DirTree t, Dirs d where t.Ancestor = :dir_id',
+                         'and d.DirID = t.Descendant and d.PlaceId = :place_id',
+                         'and t.Depth >= :top and (:level = 0 or t.Depth - :top <= :level)',
+                         'order by t.Descendant;')),
 
            'PRAGMA': 'PRAGMA foreign_keys = ON;',
 
-           'FILE_IDS_ALL_TAG': ' '.join(('select FileID from FileTag where TagID in ({})',
-                                         'group by FileID having count(*) = {};')),
            'PLACES': 'select * from Places;',
            'PLACE_IN_DIRS': 'select DirId from Dirs where PlaceId = ?;',
-           'PATH': 'select Path, PlaceId from Dirs where DirID = ?;',
            'IS_EXIST': 'select * from Places where Place = ?;',
            'EXT': ' '.join(('select Extension as title, ExtID+{}, GroupID'.format(EXT_ID_INCREMENT),
                             'as ID from Extensions UNION select GroupName as title,',
@@ -45,37 +58,46 @@ Selects = {'TREE':  # (Dir name, DirID, ParentID, Full path of dir)
            'EXT_ID_IN_GROUP': 'select ExtID from Extensions where GroupID = ?;',
            'EXT_IN_GROUP': 'select Extension, ExtID from Extensions where GroupID = ?;',
            'EXT_IN_FILES': 'select FileID from Files where ExtID = ?;',
-           'FILE_INFO': ' '.join(('select A.FileName || " " || COALESCE(B.BookTitle, "")',
-                                  '|| " " || COALESCE(B.Comment, ""), A.FileID from',
-                                  'Files A left join Comments B on B.CommentID = A.CommentID',
-                                  'where A.ExtID in ({}) and NOT EXISTS (select * from FileTag',
-                                  'where FileID = A.FileID and TagID = {});')),
-           'FILE_IN_DIR': 'select FileID from Files where DirID={} and FileName="{}";',
+           'FILE_IN_DIR': 'select FileID from Files where DirID = ? and FileName = ?;',
            'TAGS': 'select Tag, TagID from Tags order by Tag COLLATE NOCASE;',
            'FILE_TAGS': ' '.join(('select Tag, TagID from Tags where TagID in',
                                   '(select TagID from FileTag where FileID = ?);')),
            'TAG_FILES': 'select * from FileTag where TagID=:tag_id;',
-           'TAGS_BY_NAME': 'select Tag, TagID from Tags where Tag in ("{}");',
+           'TAGS_BY_NAME': ' '.join(('select Tag, TagID from Tags where Tag in',
+                                     '(select value from json_each(?));')),
            'TAG_FILE': 'select * from FileTag where FileID = ? and TagID =?;',
-           'FILE_IDS_ANY_TAG': 'select FileID from FileTag where TagID in ({}) order by FileID;',
            'AUTHORS': 'select Author, AuthorID from Authors order by Author COLLATE NOCASE;',
            'FILE_AUTHORS': ' '.join(('select Author, AuthorID from Authors where AuthorID in',
                                      '(select AuthorID from FileAuthor where FileID = ?);')),
            'AUTHOR_FILES': 'select * from FileAuthor where AuthorID=:author_id;',
-           'AUTHORS_BY_NAME': 'select Author, AuthorID from Authors where Author in ("{}");',
+           'AUTHORS_BY_NAME': ' '.join(('select Author, AuthorID from Authors where Author in',
+                                        '(select value from json_each(?));')),
            'AUTHOR_FILE': 'select * from FileAuthor where FileID = ? and AuthorID =?;',
-           'FILE_IDS_AUTHORS': 'select FileID from FileAuthor where AuthorID in ({});',
            'FILE_COMMENT': 'select Comment, BookTitle from Comments where CommentID = ?;',
+           # (dir tree, extensions and groups, any of tags, all tags, any of authors,
+           #  file date, issue date, select), conditions are semi-joins; {} is '+'
+           #  to test membership in the set instead of search by index, see generate_adv_sql
            'ADV_SELECT':
                (
-                   'and DirID in ({})',
-                   'and ExtID in ({})',
-                   'and FileID in ({})',
-                   'and FileDate > {}',
-                   'and IssueDate > {}',
-                   ' '.join(('select FileName, FileDate, Pages, Size, IssueDate,',
-                             'Opened, Commented, FileID, DirID, coalesce(CommentID, 0),',
-                             'ExtID, PlaceId from Files where PlaceId = {}'))
+                   ' '.join(('and {}f.DirID in (select t.Descendant from DirTree t',
+                             'where t.Ancestor = :dir_id and t.Depth >= :top',
+                             'and (:level = 0 or t.Depth - :top <= :level))')),
+                   ' '.join(('and {}f.ExtID in (select value from json_each(:exts)',
+                             'union all select ExtID from Extensions',
+                             'where GroupID in (select value from json_each(:groups)))')),
+                   ' '.join(('and f.FileID in (select FileID from FileTag',
+                             'where TagID in (select value from json_each(:tags)))')),
+                   ' '.join(('and f.FileID in (select FileID from FileTag',
+                             'where TagID in (select value from json_each(:tags))',
+                             'group by FileID having count(*) =',
+                             '(select count(distinct value) from json_each(:tags)))')),
+                   ' '.join(('and f.FileID in (select FileID from FileAuthor',
+                             'where AuthorID in (select value from json_each(:authors)))')),
+                   'and f.FileDate > :date',
+                   'and f.IssueDate > :date',
+                   ' '.join(('select f.FileName, f.FileDate, f.Pages, f.Size, f.IssueDate,',
+                             'f.Opened, f.Commented, f.FileID, f.DirID, coalesce(f.CommentID, 0),',
+                             'f.ExtID, f.PlaceId from Files f where {}f.PlaceId = :place'))
                ),
            'FILES_CURR_DIR': ' '.join(('select FileName, FileDate, Pages, Size, IssueDate,',
                                        'Opened, Commented, FileID, DirID, coalesce(CommentID, 0),',
@@ -84,6 +106,17 @@ Selects = {'TREE':  # (Dir name, DirID, ParentID, Full path of dir)
                                   'Commented, FileID, DirID, coalesce(CommentID, 0), ExtID, PlaceId',
                                   'from Files where FileID in (select FileID from FilesVirt where',
                                   'DirID = ?);')),
+           'DUPLICATES': ' '.join(('select FileName, FileDate, Pages, Size, IssueDate, Opened,',
+                                   'Commented, FileID, DirID, coalesce(CommentID, 0), ExtID, PlaceId',
+                                   'from Files where Hash in (select Hash from Files',
+                                   'where Hash is not null group by Hash having count(*) > 1)',
+                                   'order by Size desc, Hash, PlaceId;')),
+           # weights of columns: FileName, BookTitle, Comment, Tags, Authors
+           'SEARCH': ' '.join(('select f.FileName, f.FileDate, f.Pages, f.Size, f.IssueDate,',
+                               'f.Opened, f.Commented, f.FileID, f.DirID, coalesce(f.CommentID, 0),',
+                               'f.ExtID, f.PlaceId from FilesFTS, Files f',
+                               'where FilesFTS match :query and f.FileID = FilesFTS.rowid',
+                               'order by bm25(FilesFTS, 10.0, 5.0, 1.0, 3.0, 3.0) limit :limit;')),
            'FAV_ID': 'select DirID from Dirs where isVirtual = 1 and PlaceId = ?',
            'ISSUE_DATE': 'select IssueDate from Files where FileID = ?;',
            'EXIST_IN_VIRT_DIRS': 'select * from VirtDirs where DirID = ? and ParentID = ?;'
@@ -99,15 +132,15 @@ Insert = {'PLACES': 'insert into Places (Place, Title) values(?, ?);',
           'TAGS': 'insert into Tags (Tag) values (:tag);',
           'TAG_FILE': 'insert into FileTag (TagID, FileID) values (:tag_id, :file_id);',
           'COPY_TAGS': ' '.join(('insert into FileTag (TagID, FileID) select TagID,',
-                                 '{} from FileTag where FileID = {};')),
+                                 '? from FileTag where FileID = ?;')),
           'COPY_AUTHORS': ' '.join(('insert into FileAuthor (AuthorID, FileID) select AuthorID,',
-                                    '{} from FileAuthor where FileID = {};')),
+                                    '? from FileAuthor where FileID = ?;')),
           'COPY_FILE': ' '.join(('insert into Files (DirID, PlaceId, ExtID,',
                                  'FileName, CommentID, FileDate, Pages, Size,',
-                                 'IssueDate, Opened, Commented) SELECT {}, {},',
+                                 'IssueDate, Opened, Commented) SELECT ?, ?,',
                                  'ExtID, FileName, CommentID, FileDate, Pages,',
                                  'Size, IssueDate, Opened, Commented FROM Files',
-                                 'where FileID = {};')),
+                                 'where FileID = ?;')),
           'DIR': 'insert into Dirs (Path, ParentID, PlaceId, isVirtual) values (?, ?, ?, ?);',
           'VIRTUAL_DIR': 'insert into VirtDirs (ParentID, DirID, PlaceID) values (?, ?, ?);',
           }
@@ -144,8 +177,8 @@ Delete = {'EXT': 'delete from Extensions where ExtID = ?;',
           'FILE_VIRT': 'delete from FilesVirt where DirID = ? and FileID = ?;',
           'FAVOR_ALL': 'delete from FilesVirt where FileID = ?;',
           'PLACES': 'delete from Places where PlaceId = ?;',
-          'COMMENT': ' '.join(('delete from Comments where CommentID = {} and',
-                               'not exists (select * from Files where CommentID = {});')),
+          'COMMENT': ' '.join(('delete from Comments where CommentID = :comment_id and',
+                               'not exists (select * from Files where CommentID = :comment_id);')),
           'FILE': 'delete from Files where FileID = ?;',
           'AUTHOR_FILE': 'delete from FileAuthor where AuthorID=:author_id and FileID=:file_id;',
           'AUTHOR': 'delete from Authors where AuthorID=:author_id;',
@@ -160,6 +193,125 @@ Delete = {'EXT': 'delete from Extensions where ExtID = ?;',
           'VIRT_DIR_ID': 'delete from VirtDirs where DirID = ?;'
           }
 
+# Insert / Update / Delete keys that change tables held in lookup caches
+LookupInsert = {'AUTHORS': 'author', 'TAGS': 'tag'}
+LookupInvalidate = {'EXT': 'ext', 'UNUSED_EXT': 'ext',
+                    'AUTHOR': 'author', 'UNUSED_AUTHORS': 'author',
+                    'TAG': 'tag', 'UNUSED_TAGS': 'tag', 'UPDATE_TAG': 'tag',
+                    'DIR_NAME': 'path', 'DIR_PARENT': 'path',
+                    'EMPTY_DIRS': 'path', 'VIRT_FROM_DIRS': 'path'}
+
+
+DETECT_TYPES = sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES
+BUSY_TIMEOUT = 30       # seconds to wait for the lock held by other connection
+STATEMENT_CACHE = 128   # prepared statements kept by each connection (LRU)
+SEARCH_LIMIT = 5000     # max number of files found by full text search
+
+# connection profiles: 'ui' - connection of GUI thread,
+# 'writer' - connection of background worker, 'reader' - long reads of worker
+Pragmas = {'WAL': 'PRAGMA journal_mode = WAL;',
+           'ui': ('PRAGMA foreign_keys = ON;',
+                  'PRAGMA synchronous = NORMAL;',
+                  'PRAGMA cache_size = -32000;',
+                  'PRAGMA mmap_size = 268435456;',
+                  'PRAGMA temp_store = MEMORY;'),
+           'writer': ('PRAGMA foreign_keys = ON;',
+                      'PRAGMA synchronous = NORMAL;',
+                      'PRAGMA cache_size = -64000;',
+                      'PRAGMA mmap_size = 268435456;',
+                      'PRAGMA temp_store = MEMORY;'),
+           'reader': ('PRAGMA cache_size = -16000;',
+                      'PRAGMA mmap_size = 268435456;',
+                      'PRAGMA temp_store = MEMORY;')
+           }
+
+
+def fts_query(text):
+    """
+    Query of full text search from text of search box:
+    "words in quotes" - phrase, other words - prefixes, all must match
+    :param text:
+    :return: FTS5 query, '' if text has no words
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', text):
+        if phrase.strip():
+            terms.append('"{}"'.format(phrase))
+        else:
+            word = word.rstrip('*')
+            if word:
+                terms.append('"{}"*'.format(word.replace('"', '""')))
+    return ' '.join(terms)
+
+
+class StatementCache:
+    """
+    Bookkeeping of statement cache of sqlite3 connection: LRU of SQL texts
+    of the same size as cached_statements of connection, so a miss here is
+    a compile of statement by sqlite3 and a hit is reuse of prepared one
+    """
+    def __init__(self, size=STATEMENT_CACHE):
+        self.size = size
+        self.hits = 0
+        self.compiles = 0
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+    def use(self, sql):
+        """
+        :param sql: text of statement going to be executed
+        :return: None
+        """
+        with self._lock:
+            if sql in self._lru:
+                self._lru.move_to_end(sql)
+                self.hits += 1
+            else:
+                self.compiles += 1
+                self._lru[sql] = None
+                if len(self._lru) > self.size:
+                    self._lru.popitem(last=False)
+
+    def get_stats(self):
+        """
+        :return: (hits, compiles)
+        """
+        return self.hits, self.compiles
+
+
+class CountedCursor(sqlite3.Cursor):
+    """
+    Cursor that counts its statements in statement cache of connection
+    """
+    def execute(self, sql, parameters=()):
+        self.connection.statements.use(sql)
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self.connection.statements.use(sql)
+        return super().executemany(sql, seq_of_parameters)
+
+
+class CountedConnection(sqlite3.Connection):
+    """
+    Connection, factory of sqlite3.connect, all its statements are
+    counted in StatementCache: Connection.execute and cursors of
+    any user (DBUtils, lookup caches, create_db) use CountedCursor.
+    executescript is not counted, it bypasses statement cache
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = StatementCache(kwargs.get('cached_statements', STATEMENT_CACHE))
+
+    def cursor(self, factory=CountedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
 
 class DBUtils:
     """Different methods for select, update and insert information into/from DB"""
@@ -167,13 +319,117 @@ class DBUtils:
     def __init__(self):
         self.conn = None
         self.curs = None
+        self.lookups = {}
         Shared['DB utility'] = self
 
     def set_connection(self, connection):
+        """
+        Connection of GUI thread. Switch DB into WAL mode, so background
+        workers write through their own connections (open_writer)
+        while GUI reads
+        :param connection:
+        :return: None
+        """
+        if self.conn is not None and self.conn is not connection:
+            print('--> DBUtils.set_connection, statement cache of previous DB, hits, compiles:',
+                  *DBUtils.statement_stats(self.conn))
         self.conn = connection
         self.curs = connection.cursor()
+        mode = self.curs.execute(Pragmas['WAL']).fetchone()[0]
+        print('--> DBUtils.set_connection, journal mode:', mode)
+        DBUtils._set_pragmas(connection, 'ui')
+        self.lookups = {name: LookupCache(connection, name)
+                        for name in ('ext', 'author', 'tag')}
+        self.lookups['path'] = PathCache(connection)
+        self.lookups['details'] = DetailCache(connection)
         Shared['DB connection'] = connection
 
+    def get_statement_stats(self):
+        """
+        :return: (hits, compiles) of statement cache of GUI connection
+        """
+        return DBUtils.statement_stats(self.conn)
+
+    @staticmethod
+    def statement_stats(connection):
+        """
+        :param connection:
+        :return: (hits, compiles), (0, 0) if connection is not CountedConnection
+        """
+        statements = getattr(connection, 'statements', None)
+        return statements.get_stats() if statements else (0, 0)
+
+    @staticmethod
+    def id_list(ids):
+        """
+        Bind set of values as one parameter, used in SQL as
+        'in (select value from json_each(?))', so the text of
+        statement does not depend on values and is compiled once
+        :param ids: iterable of IDs or names
+        :return: JSON array
+        """
+        return json.dumps(list(ids))
+
+    def _execute(self, sql, params=()):
+        return self.curs.execute(sql, params)
+
+    def get_lookup(self, name):
+        """
+        Cache name -> ID shared by all users of DB connection,
+        or cache DirID -> (Path, PlaceId) for name 'path',
+        or cache FileID -> file_details for name 'details'
+        :param name: 'ext', 'author', 'tag', 'path' or 'details'
+        :return: LookupCache, PathCache or DetailCache
+        """
+        return self.lookups[name]
+
+    def open_reader(self):
+        """
+        Separate connection to the same DB for long reads in worker thread,
+        in autocommit mode - no read transaction is kept open between queries
+        :return: new connection or None for in-memory DB
+        """
+        return self._connect('reader', isolation_level=None)
+
+    def open_writer(self):
+        """
+        Own connection of background worker (LoadFiles, FileInfo, FileHash),
+        in WAL mode its writes do not block reads of GUI connection
+        :return: new connection or None for in-memory DB
+        """
+        return self._connect('writer')
+
+    def close_connection(self, connection):
+        """
+        Close connection got by open_reader / open_writer
+        :param connection:
+        :return: None
+        """
+        if connection is not None and connection is not self.conn:
+            print('--> close_connection, statement cache hits, compiles:',
+                  *DBUtils.statement_stats(connection))
+            connection.close()
+
+    def _connect(self, profile, **kwargs):
+        file_name = self._db_file()
+        if not file_name:
+            return None
+        connection = sqlite3.connect(file_name, check_same_thread=False,
+                                     detect_types=DETECT_TYPES, timeout=BUSY_TIMEOUT,
+                                     cached_statements=STATEMENT_CACHE,
+                                     factory=CountedConnection, **kwargs)
+        DBUtils._set_pragmas(connection, profile)
+        return connection
+
+    def _db_file(self):
+        return next((row[2] for row in self.conn.execute('PRAGMA database_list;')
+                     if row[1] == 'main'), '')
+
+    @staticmethod
+    def _set_pragmas(connection, profile):
+        for pragma in Pragmas[profile]:
+            connection.execute(pragma)
+
     def advanced_selection(self, param, cur_place_id):
         # print('|---> advanced_selection', param)
 
@@ -181,54 +437,82 @@ class DBUtils:
         # print(sql)
 
         if sql:
-            return self.curs.execute(sql)
-        return ()
+            return self._select_lazy(*sql)
+        return None
 
     @staticmethod
     def generate_adv_sql(cur_place_id, param):
-        # print(Selects['ADV_SELECT'])
-        # print('cur_place_id:', cur_place_id)
-        # print(param)
-        res_sql = [Selects['ADV_SELECT'][5].format(cur_place_id)]
+        """
+        One select of files by all conditions of SelOpt dialog
+        :param cur_place_id:
+        :param param: result of SelOpt dialog
+        :return: (sql, parameters) or None if nothing can be selected
+        """
+        clauses = Selects['ADV_SELECT']
+        # files of tags or authors drive the query by FileID, without '+' SQLite
+        # searches index (PlaceId, DirID, rowid) by all pairs: dir x file
+        by_file_id = '+' if param.tags.use or param.authors.use else ''
+        res_sql = [clauses[7].format(by_file_id)]
+        params = {'place': cur_place_id}
 
         if param.dir.use:  # select files by directory tree
-            res_sql.append(Selects['ADV_SELECT'][0].format(param.dir.list))
-
-        if param.extension.use and param.extension.list:  # by extension
-            res_sql.append(Selects['ADV_SELECT'][1].format(param.extension.list))
-
-        if param.tags.use and param.authors.use:  # by tags and authors
-            t1 = set(param.tags.list.split(','))
-            t2 = set(param.authors.list.split(','))
-            tmp = t1.intersection(t2)
-            if tmp:
-                res_sql.append(Selects['ADV_SELECT'][2].format(','.join(tmp)))
-            else:
-                return ''
-
-        elif param.tags.use:  # tags, authors not used
-            if param.tags.list:
-                res_sql.append(Selects['ADV_SELECT'][2].format(param.tags.list))
-            else:
-                return ''
-
-        elif param.authors.use:  # authors, tags not used
-            if param.authors.list:
-                res_sql.append(Selects['ADV_SELECT'][2].format(param.authors.list))
-            else:
-                return ''
+            res_sql.append(clauses[0].format(by_file_id))
+            params.update(DBUtils.tree_params(param.dir.id, param.dir.level, cur_place_id))
+
+        if param.extension.use and (param.extension.ids or param.extension.groups):
+            res_sql.append(clauses[1].format(by_file_id))
+            params['exts'] = DBUtils.id_list(param.extension.ids)
+            params['groups'] = DBUtils.id_list(param.extension.groups)
+
+        if param.tags.use:  # by tags: all / any of them
+            if not param.tags.ids:
+                return None
+            res_sql.append(clauses[3] if param.tags.match_all else clauses[2])
+            params['tags'] = DBUtils.id_list(param.tags.ids)
+
+        if param.authors.use:  # by authors: any of them
+            if not param.authors.ids:
+                return None
+            res_sql.append(clauses[4])
+            params['authors'] = DBUtils.id_list(param.authors.ids)
 
         if param.date.use:  # by date
             tt = datetime.date.today()
             tt = tt.replace(year=tt.year - int(param.date.date))
             if param.date.file_date:  # date of file
-                res_sql.append(Selects['ADV_SELECT'][3].format(tt))
+                res_sql.append(clauses[5])
             else:  # date of book issue
-                res_sql.append(Selects['ADV_SELECT'][4].format(tt))
+                res_sql.append(clauses[6])
+            params['date'] = tt.isoformat()
 
         res_sql.append(';')
         sql = ' '.join([clause for clause in res_sql])
-        return sql
+        return sql, params
+
+    def search_files(self, text):
+        """
+        Files of all places with text in name, book title, comment,
+        tags or authors, the best matches first
+        :param text: see fts_query
+        :return: (cursor, count function, order function), see select_lazy,
+                 None if nothing to search or no full text index
+        """
+        query = fts_query(text)
+        if query:
+            self.sync_fts()
+            try:
+                return self._select_lazy(Selects['SEARCH'], {'query': query, 'limit': SEARCH_LIMIT})
+            except sqlite3.OperationalError as err:
+                print('--> search_files', err)
+        return None
+
+    def sync_fts(self, connection=None):
+        """
+        Apply changes of files to full text index
+        :param connection: of worker, None - connection of GUI
+        :return: None
+        """
+        create_db.sync_fts(connection or self.conn)
 
     def dir_tree_select(self, dir_id, level, place_id):
         """
@@ -238,10 +522,7 @@ class DBUtils:
         :param place_id:
         :return: cursor of directories
         """
-        sql = DBUtils.generate_sql(dir_id, level, place_id)
-        print(sql)
-
-        self.curs.execute(sql)
+        self._execute(Selects['TREE'], DBUtils.tree_params(dir_id, level, place_id))
 
         return self.curs
 
@@ -253,70 +534,93 @@ class DBUtils:
         :param place_id:
         :return: list of directories ids
         """
-        sql = DBUtils.generate_sql(dir_id, level, place_id, sql='DIR_IDS')
-
-        self.curs.execute(sql)
+        self._execute(Selects['DIR_IDS'], DBUtils.tree_params(dir_id, level, place_id))
 
         return self.curs.fetchall()
 
     @staticmethod
-    def generate_sql(dir_id, level, place_id, sql='TREE'):
-        tree_sql = Selects[sql]
-        tmp = (tree_sql[0], tree_sql[1].format(dir_id, place_id),
-               tree_sql[2].format(dir_id, place_id), tree_sql[3],
-               tree_sql[4].format(level), tree_sql[5])
-        cc = [(0, 2, 3, 5),
-              (0, 1, 3, 5),
-              (0, 2, 3, 4),
-              (0, 1, 3, 4)]
-        i = (level > 0) * 2 + (dir_id > 0)  # 00 = 0, 01 = 1, 10 = 2, 11 = 3
-        sql = ' '.join([tmp[j] for j in cc[i]])
-        return sql
+    def tree_params(dir_id, level, place_id):
+        """
+        Parameters of TREE and DIR_IDS selects. DirID 0 is the common
+        root of all places in DirTree, its children are on level 0
+        """
+        return {'dir_id': dir_id, 'level': level, 'place_id': place_id,
+                'top': int(dir_id == 0)}
+
+    def rebuild_dir_tree(self):
+        """
+        Refill closure table DirTree from Dirs
+        :return: None
+        """
+        create_db.rebuild_dir_tree(self.conn)
 
     def select_other(self, sql, params=()):
         # print('|---> select_other', sql, params)
         # print(Selects[sql])
-        self.curs.execute(Selects[sql], params)
-        return self.curs
+        return self._execute(Selects[sql], params)
 
-    def select_other2(self, sql, params=()):
-        # print('|---> select_other2', sql, params)
-        # print(Selects[sql].format(*params))
-        self.curs.execute(Selects[sql].format(*params))
-        return self.curs
+    def select_lazy(self, sql, params=()):
+        """
+        Select for lazy TableModel, rows are read when view needs them
+        :param sql: key of Selects
+        :param params:
+        :return: (cursor, count function, order function)
+        """
+        return self._select_lazy(Selects[sql], params)
+
+    def _select_lazy(self, sql, params):
+        """
+        Own cursor, it is not reset by next queries as self.curs is,
+        function that counts all rows of select and function
+        (column number from 1, descending) -> own cursor of the same
+        select sorted by SQLite, so not fetched rows needn't be read to sort
+        """
+        select = sql.rstrip(';')
+        count_sql = 'select count(*) from ({});'.format(select)
+
+        def order_by(column, descending=False):
+            return self._own_cursor('select * from ({}) order by {} {};'.format(
+                select, int(column), 'desc' if descending else 'asc'), params)
+
+        return (self._own_cursor(sql, params),
+                lambda: self._execute(count_sql, params).fetchone()[0],
+                order_by)
+
+    def _own_cursor(self, sql, params):
+        cursor = self.conn.cursor()
+        cursor.execute(sql, params)
+        return cursor
 
     def insert_other(self, sql, data):
         # print('|---> insert_other', Insert[sql], data)
-        self.curs.execute(Insert[sql], data)
+        if sql in LookupInsert:
+            lookup = self.lookups[LookupInsert[sql]]
+            jj = lookup.intern(data[0])
+            lookup.flush(self.curs)
+            self.conn.commit()
+            return jj
+        self._execute(Insert[sql], data)
         jj = self.curs.lastrowid
         self.conn.commit()
         # print('  lastrowid:', jj)
         return jj
 
-    def insert_other2(self, sql, data):
-        # print('|---> insert_other2', Insert[sql].format(*data))
-        self.curs.execute(Insert[sql].format(*data))
-        jj = self.curs.lastrowid
-        self.conn.commit()
-        # print('  _id:', jj)
-        return jj
-
     def update_other(self, sql, data):
         # print('|---> update_other:', Update[sql], data)
-        self.curs.execute(Update[sql], data)
+        self._execute(Update[sql], data)
         self.conn.commit()
+        self._invalidate_lookup(sql)
 
     def delete_other(self, sql, data):
         # print('|---> delete_other:', sql, data)
         try:
-            self.curs.execute(Delete[sql], data)
+            self._execute(Delete[sql], data)
         except sqlite3.IntegrityError:
             pass
         else:
             self.conn.commit()
+            self._invalidate_lookup(sql)
 
-    def delete_other2(self, sql, data):
-        # print('|---> delete_other:', sql, data)
-        # print(Delete[sql].format(*data))
-        self.curs.execute(Delete[sql].format(*data))
-        self.conn.commit()
+    def _invalidate_lookup(self, sql):
+        if sql in LookupInvalidate:
+            self.lookups[LookupInvalidate[sql]].invalidate()
@@ -28,6 +28,7 @@ def main():
 
     _controller = MyController()
     main_window.scan_files_signal.connect(_controller.on_scan_files)
+    main_window.search_signal.connect(_controller.on_search)
 
     # when data changed on any widget
     main_window.change_data_signal.connect(_controller.on_change_data)
@@ -14,6 +14,7 @@ from model.helper import (real_folder, virtual_folder, file_real,
 class AppWindow(QMainWindow):
     change_data_signal = pyqtSignal(str)   # str - name of action
     scan_files_signal = pyqtSignal()
+    search_signal = pyqtSignal(str)        # str - text to search
 
     def __init__(self, parent=None):
         QMainWindow.__init__(self, parent)
@@ -46,6 +47,7 @@ class AppWindow(QMainWindow):
         self.ui.cb_places.currentIndexChanged.connect(lambda: self.change_data_signal.emit('Change place'))
         self.ui.commentField.anchorClicked.connect(self.ref_clicked)
         self.ui.filesList.doubleClicked.connect(lambda: self.change_data_signal.emit('File_doubleClicked'))
+        self.ui.searchEdit.returnPressed.connect(self._search)
 
         self.ui.dirTree.startDrag = self._start_drag
         self.ui.dirTree.dropEvent = self._drop_event
@@ -54,6 +56,11 @@ class AppWindow(QMainWindow):
 
         self.ui.filesList.resizeEvent = self.resize_event
 
+    def _search(self):
+        text = self.ui.searchEdit.text().strip()
+        if text:
+            self.search_signal.emit(text)
+
     def _drag_move_event(self, event: QDragMoveEvent):
         index = self.ui.dirTree.indexAt(event.pos())
         mime_data = event.mimeData()
@@ -142,14 +149,24 @@ class AppWindow(QMainWindow):
         menu = QMenu(self)
         change_font = menu.addAction('Change Font')
         set_fields = menu.addAction('Set fields')
+        menu.addSeparator()
+        hash_files = menu.addAction('Hash files')
+        hash_after_scan = menu.addAction('Hash files after scan')
+        hash_after_scan.setCheckable(True)
+        hash_after_scan.setChecked(QSettings().value('HASH_AFTER_SCAN', False, type=bool))
         self.ui.btnOption.setMenu(menu)
         change_font.triggered.connect(lambda: self.change_data_signal.emit('change_font'))
         set_fields.triggered.connect(lambda: self.change_data_signal.emit('Set fields'))
+        hash_files.triggered.connect(lambda: self.change_data_signal.emit('Hash files'))
+        hash_after_scan.toggled.connect(
+            lambda checked: self.change_data_signal.emit('Hash after scan/{:d}'.format(checked)))
 
         menu2 = QMenu(self)
         sel_opt = menu2.addAction('Selection options')
+        duplicates = menu2.addAction('Duplicates')
         self.ui.btnGetFiles.setMenu(menu2)
         sel_opt.triggered.connect(lambda: self.change_data_signal.emit('Selection options'))
+        duplicates.triggered.connect(lambda: self.change_data_signal.emit('Duplicates'))
 
     def setup_context_menu(self):
         """
@@ -215,6 +232,7 @@ class AppWindow(QMainWindow):
         idx = self.ui.dirTree.indexAt(pos)
         menu = QMenu(self)
         menu.addAction('Remove empty folders')
+        menu.addAction('Rebuild tree')
         if idx.isValid():
             if self.ui.dirTree.model().is_virtual(idx):
                 if not self.ui.dirTree.model().is_favorites(idx):
@@ -227,6 +245,8 @@ class AppWindow(QMainWindow):
                     menu.addSeparator()
                     menu.addAction('Delete folder')
                 menu.addAction('Rescan dir')
+                menu.addAction('Full rescan dir')
+                menu.addAction('Refresh file info')
                 menu.addSeparator()
                 menu.addAction('Group')
             menu.addSeparator()
@@ -94,26 +94,28 @@ class SelOpt(QDialog):
         self.ui.tagAny.setEnabled(state)
 
     def get_result(self):
+        """
+        Conditions of selection, IDs of selected items, not of files:
+        files are selected by one query, see DBUtils.generate_adv_sql
+        :return: result
+        """
         result = namedtuple('result', 'dir extension tags authors date')
-        dir_ = namedtuple('dir', 'use list')
-        extension = namedtuple('extension', 'use list')
-        tags = namedtuple('tags', 'use match_all list')
-        authors = namedtuple('authors', 'use list')
+        dir_ = namedtuple('dir', 'use id level')
+        extension = namedtuple('extension', 'use ids groups')
+        tags = namedtuple('tags', 'use match_all ids')
+        authors = namedtuple('authors', 'use ids')
         doc_date = namedtuple('not_older', 'use date file_date')
 
-        dir_ids = self._get_dir_ids()
-        ext_ids = self._get_ext_ids()
-        tag_ids = self._get_tags_id()
-        author_ids = self._get_authors_id()
+        ext_ids, group_ids = self._get_ext_ids()
 
-        res = result(dir=dir_(use=self.ui.chDirs.isChecked(), list=dir_ids),
+        res = result(dir=dir_(use=self.ui.chDirs.isChecked(), id=self._get_dir_id(), level=0),
                      extension=extension(use=self.ui.chExt.isChecked(),
-                                         list=ext_ids),
+                                         ids=ext_ids, groups=group_ids),
                      tags=tags(use=self.ui.chTags.isChecked(),
-                               list=tag_ids,
+                               ids=self._get_items_id(self.ctrl.ui.tagsList),
                                match_all=self.ui.tagAll.isChecked()),
                      authors=authors(use=self.ui.chAuthor.isChecked(),
-                                     list=author_ids),
+                                     ids=self._get_items_id(self.ctrl.ui.authorsList)),
                      date=doc_date(use=self.ui.chDate.isChecked(),
                                    date=self.ui.eDate.text(),
                                    file_date=self.ui.dateFile.isChecked()))
@@ -125,70 +127,26 @@ class SelOpt(QDialog):
                                                 res.date.file_date)))
         return res
 
-    def _get_dir_ids(self):
+    def _get_dir_id(self):
         if self.ui.chDirs.isChecked():
-            lvl = 0
             idx = self.ctrl.ui.dirTree.currentIndex()
-            root_id = int(self.ctrl.ui.dirTree.model().data(idx, Qt.UserRole)[0])
-            place_id = self.ctrl.get_place_instance().get_curr_place()[1][0]
-
-            ids = ','.join([str(id_[0]) for id_ in
-                            self.ctrl.get_db_utils().dir_ids_select(root_id, lvl, place_id)])
-            return ids
+            return int(self.ctrl.ui.dirTree.model().data(idx, Qt.UserRole)[0])
         return None
 
-    def _get_ext_ids( self ):
+    def _get_ext_ids(self):
+        """
+        :return: (ExtIDs, GroupIDs) of selected extensions and groups
+        """
+        ext_ids, group_ids = [], []
         if self.ui.chExt.isChecked():
-            sel_idx = self.ctrl.ui.extList.selectedIndexes()
             model = self.ctrl.ui.extList.model()
-            aux = []
-            for id_ in sel_idx:
-                aux.append(model.data(id_, Qt.UserRole))
-
-            idx = []
-            for id_ in aux:
-                if id_[0] > EXT_ID_INCREMENT:
-                    idx.append(id_[0] - EXT_ID_INCREMENT)
-                else:
-                    idx += self._ext_in_group(id_[0])
-
-            idx.sort()
-            return ','.join([str(id_) for id_ in idx])
-        return None
-
-    def _ext_in_group(self, gr_id):
-        curr = self.ctrl.get_db_utils().select_other('EXT_ID_IN_GROUP', (gr_id,))
-        idx = []
-        for id_ in curr:
-            idx.append(id_[0])
-
-        return idx
-
-    def _get_tags_id(self):
-        if self.ui.chTags.isChecked():
-            tags = self._get_items_id(self.ctrl.ui.tagsList)
-            if tags:
-                if self.ui.tagAll.isChecked():
-                    num = len(tags.split(','))
-                    res = self.ctrl.get_db_utils().select_other2('FILE_IDS_ALL_TAG',
-                                                                 (tags, num)).fetchall()
+            for idx in self.ctrl.ui.extList.selectedIndexes():
+                id_ = model.data(idx, Qt.UserRole)[0]
+                if id_ > EXT_ID_INCREMENT:
+                    ext_ids.append(id_ - EXT_ID_INCREMENT)
                 else:
-                    res = self.ctrl.get_db_utils().select_other2('FILE_IDS_ANY_TAG',
-                                                                 (tags,)).fetchall()
-                return ','.join(str(ix[0]) for ix in res)
-
-            return ''
-
-        return None
-
-    def _get_authors_id(self):
-        if self.ui.chAuthor.isChecked():
-            auth_ids = self._get_items_id(self.ctrl.ui.authorsList)
-            file_ids = self.ctrl.get_db_utils().select_other2('FILE_IDS_AUTHORS',
-                                                              (auth_ids,)).fetchall()
-            return ','.join(str(ix[0]) for ix in file_ids)
-
-        return None
+                    group_ids.append(id_)
+        return ext_ids, group_ids
 
     @staticmethod
     def _get_items_id(view):
@@ -198,5 +156,5 @@ class SelOpt(QDialog):
         for id_ in sel_idx:
             aux.append(model.data(id_, Qt.UserRole))
         aux.sort()
-        return ','.join([str(id_) for id_ in aux])
+        return aux
 